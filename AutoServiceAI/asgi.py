@@ -21,12 +21,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "AutoServiceAI.settings")
 django.setup()
 
 #Import websocket url patterns
-from AutoServiceAI.routing import websocket_urlpatterns
+from django.urls import re_path
+from AutoServiceAI.routing import websocket_urlpatterns, http_urlpatterns
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": URLRouter(
+        http_urlpatterns + [re_path(r"", get_asgi_application())]
+    ),
     "websocket": AllowedHostsOriginValidator(
         URLRouter(
             websocket_urlpatterns
@@ -1,9 +1,15 @@
 from django.urls import path
 
-from chats.consumers import AnonymousChatConsumer, ChatConsumer, AdminChatConsumer
+from chats.consumers import AnonymousChatConsumer, ChatConsumer, AdminChatConsumer, AdminInboxConsumer
+from chats.exports import ExportConsumer
 
 websocket_urlpatterns = [
     path("anonymous/", AnonymousChatConsumer.as_asgi()),
     path("workspace/", ChatConsumer.as_asgi()),
+    path("inbox/", AdminInboxConsumer.as_asgi()),
     path("<str:conversation>/", AdminChatConsumer.as_asgi())
-]
\ No newline at end of file
+]
+
+http_urlpatterns = [
+    path("export/<str:ticket>/", ExportConsumer.as_asgi()),
+]
@@ -159,7 +159,88 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "payloads": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": f"{REDIS_URL}/1",
+        "TIMEOUT": 60 * 60 * 24,
+    },
+}
 
+# Rendered chat messages, see chats.payloads
+MESSAGE_PAYLOAD_CACHE = "payloads"
+
+# Incoming websocket frames allowed per consumer class as (tokens per second, burst),
+# for every connection and for every conversation, see chats.throttling
+WEBSOCKET_RATE_LIMITS = {
+    "AnonymousChatConsumer": {
+        "connection": {"chat_message": (1, 5)},
+        "conversation": {"chat_message": (2, 10)},
+    },
+    "ChatConsumer": {
+        "connection": {"typing": (2, 5), "chat_message": (1, 5), "read_up_to": (2, 10)},
+        "conversation": {"typing": (5, 10), "chat_message": (2, 10)},
+    },
+    "AdminChatConsumer": {
+        "connection": {"typing": (2, 5), "chat_message": (1, 5), "request_payment": (0.2, 3), "request_document": (0.2, 3), "read_up_to": (2, 10)},
+        "conversation": {"typing": (5, 10), "chat_message": (2, 10)},
+    },
+    "AdminInboxConsumer": {
+        "connection": {"typing": (5, 10), "chat_message": (2, 10), "request_payment": (0.2, 3), "request_document": (0.2, 3), "read_up_to": (5, 20), "subscribe": (5, 100)},
+        "conversation": {"typing": (5, 10), "chat_message": (2, 10)},
+    },
+}
+
+# Seconds without a typing frame before a sender is considered to have stopped typing
+TYPING_TIMEOUT = 6
+
+# A websocket counts as present in its conversations for PRESENCE_TIMEOUT seconds
+# and refreshes that every PRESENCE_HEARTBEAT seconds, see chats.presence
+PRESENCE_TIMEOUT = 60
+PRESENCE_HEARTBEAT = 20
+
+# Conversations are deleted in the background, DELETION_BATCH_SIZE rows per transaction
+# and DELETION_BLOB_WORKERS storage deletes at a time, see chats.deletion
+DELETION_BATCH_SIZE = 500
+DELETION_BLOB_WORKERS = 8
+DELETION_PROGRESS_TIMEOUT = 60 * 60 * 24
+
+# Messages fetched per query while streaming a transcript export, see chats.exports
+EXPORT_CHUNK_SIZE = 2000
+
+# Postgres text search configuration used to index and query messages, see chats.search.
+# The index is built by a migration, changing this needs a new one.
+SEARCH_CONFIG = "spanish"
+
+# Provider events already handled are remembered for INBOUND_EVENT_TIMEOUT seconds in
+# Redis and the last INBOUND_EVENT_CACHE_SIZE per process, see chats.ledger. Ledger rows
+# older than INBOUND_EVENT_RETENTION days are removed by prune_inbound_events
+INBOUND_EVENT_TIMEOUT = 60 * 60 * 24 * 3
+INBOUND_EVENT_CACHE_SIZE = 10000
+INBOUND_EVENT_RETENTION = 7
+
+# Seconds a process keeps the AI/Anonymous users and integrations, see chats.registry
+REGISTRY_TIMEOUT = 300
+
+# Background jobs
+JOB_QUEUE = {
+    "BACKEND": "chats.jobs.RedisBackend",
+    "NAME": "autoservice:jobs",
+}
+
+# Runs a failed job gets before it is moved to the dead letter list
+JOB_MAX_ATTEMPTS = 5
+
+# Seconds before a failed job runs again, doubling with every attempt up to the max
+JOB_RETRY_BACKOFF = 2
+JOB_RETRY_BACKOFF_MAX = 300
+
+# Seconds without a heartbeat before a worker's unfinished jobs are requeued,
+# longer than any job is fine, the heartbeat runs alongside the job
+JOB_WORKER_TIMEOUT = 60
 
 if env('DATABASE_PASSWORD'):
     DATABASES = {
@@ -252,13 +333,52 @@ AZURE_CONTAINER = env('AZURE_CONTAINER')
 STRIPE_SECRET_KEY = env('STRIPE_SECRET_KEY')
 STRIPE_ENDPOINT_SECRET = env('STRIPE_ENDPOINT_SECRET')
 
+# Seconds a websocket ticket from register-chat/ stays valid, see chats.tickets
+WEBSOCKET_TICKET_TIMEOUT = 60
+
+# Websocket history, clients reconnecting with ?since=<message id> only get
+# what they missed unless the gap is larger than the resync threshold
+CHAT_HISTORY_SIZE = 50
+CHAT_RESYNC_THRESHOLD = 200
+# Conversations a single admin inbox socket may have open at once
+INBOX_MAX_SUBSCRIPTIONS = 100
+
+# Outbound calls to MY_GPT, WhatsApp and Telegram share pooled keep-alive connections,
+# see chats.http_client. Timeouts are in seconds, HTTP_RETRIES covers connection errors
+# and 429/502/503/504 responses (429/503 only for POST) with jittered exponential backoff
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 30
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_MAXSIZE = 10
+
 # AI things
 AI_CONTEXT_SIZE = 50
 MY_GPT_URL = env('MY_GPT_URL')
+# Seconds to wait for a reply, generating one can take much longer than other calls
+MY_GPT_TIMEOUT = 120
+# Server-sent events endpoint, when set replies are streamed to the conversation
+MY_GPT_STREAM_URL = env('MY_GPT_STREAM_URL', default=None)
 
 # Whatsapp API
 WHATSAPP_ACCESS_TOKEN = env('WHATSAPP_ACCESS_TOKEN')
 WHATSAPP_NUMBER_IDENTIFIER = env('WHATSAPP_NUMBER_IDENTIFIER')
+WHATSAPP_API_URL = env('WHATSAPP_API_URL', default='https://graph.facebook.com/v17.0')
 
 # Telegram API
 TELEGRAM_TOKEN = env('TELEGRAM_TOKEN')
+TELEGRAM_API_URL = env('TELEGRAM_API_URL', default='https://api.telegram.org')
+# Seconds getUpdates waits for updates when polling instead of using the webhook
+TELEGRAM_POLL_TIMEOUT = 30
+
+# Replies to WhatsApp and Telegram go through the deliver_messages workers, see chats.delivery.
+# Rate limits are (messages per second, burst) for the whole channel and for each recipient,
+# failed sends are retried with exponential backoff up to DELIVERY_MAX_ATTEMPTS times
+DELIVERY_RATE_LIMITS = {
+    "whatsapp": {"channel": (80, 80), "recipient": (0.2, 5)},
+    "telegram": {"channel": (30, 30), "recipient": (1, 3)},
+}
+DELIVERY_WORKERS = 8
+DELIVERY_MAX_ATTEMPTS = 6
+DELIVERY_BACKOFF = 2
+DELIVERY_BACKOFF_MAX = 300
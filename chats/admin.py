@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Integration, Conversation, Message, Document, Payment, PaymentIntent, Profile
+from .models import Integration, Conversation, Message, Document, Payment, PaymentIntent, Profile, ReadCursor, InboundEvent
 
 admin.site.register(Integration)
 admin.site.register(Conversation)
@@ -8,4 +8,6 @@ admin.site.register(Message)
 admin.site.register(Document)
 admin.site.register(Payment)
 admin.site.register(PaymentIntent)
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+admin.site.register(ReadCursor)
+admin.site.register(InboundEvent)
@@ -2,26 +2,147 @@ import string
 import random
 
 from urllib.parse import parse_qsl
-from asgiref.sync import async_to_sync
 
-from django.core.cache import cache
 from django.conf import settings
-
-from .models import Integration, Conversation, Message, Document, Payment, Profile
-from users.models import User
-from .serializers import MessageSerializer
-from .mail import send_message_notification, send_document_upload_notification, send_document_requested_notification, send_payment_requested_notification, send_new_conversation_notification_admins, send_conversation_autopilot_deactivated
-
-from .my_gpt import get_my_ai_response
-
-from channels.generic.websocket import JsonWebsocketConsumer
-
-class AnonymousChatConsumer(JsonWebsocketConsumer):
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Conversation, Message, Document, Payment
+from .registry import get_integration, aget_integration, aget_anonymous_user
+from .payloads import get_message_payloads, get_message_payload, invalidate_message_payloads
+from .mail import send_message_notification, send_documents_upload_notification, send_document_requested_notification, send_payment_requested_notification, send_new_conversation_notification_admins
+from .events import INBOX_GROUP, apublish, apublish_messages, read_receipt_event
+from .jobs import aenqueue
+from .presence import PresenceMixin
+from .counters import record_new_messages, read_up_to
+from .throttling import ThrottledConsumerMixin
+from .tickets import aconsume_ticket
+from .typing_indicators import TypingIndicatorMixin
+from .tasks import generate_autopilot_reply
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+User = get_user_model()
+
+
+def get_since(query_params):
+    try:
+        return int(query_params["since"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+@database_sync_to_async
+def get_last_messages(conversation, since=None):
+    message_ids = conversation.messages.all().order_by("-created_at", "-id").values_list("id", flat=True)
+    if since is None:
+        return get_message_payloads(message_ids[0:settings.CHAT_HISTORY_SIZE])
+    message_ids = list(message_ids.filter(id__gt=since)[0:settings.CHAT_RESYNC_THRESHOLD + 1])
+    if len(message_ids) > settings.CHAT_RESYNC_THRESHOLD:
+        return None
+    return get_message_payloads(message_ids)
+
+async def send_last_messages(consumer, conversation, since, tags=None):
+    tags = tags or {}
+    messages = await get_last_messages(conversation, since)
+    if messages is None:
+        await consumer.send_json({"type": "resync_required", **tags})
+        messages = await get_last_messages(conversation)
+    await consumer.send_json({"type": "last_messages", **tags, "messages": messages})
+
+async def reject_documents(consumer):
+    await consumer.send_json({"type": "invalid_frame", "frame": "chat_message", "error": "Invalid documents"})
+
+async def get_ticket_user(ticket_uuid, admin=False):
+    claims = await aconsume_ticket(ticket_uuid)
+    if not claims or (admin and not claims["admin"]):
+        return None
+    try:
+        user = await User.objects.select_related("profile").aget(id=claims["user_id"])
+    except User.DoesNotExist:
+        return None
+    if admin and not user.profile.admin:
+        return None
+    return user
+
+# The message, its documents and the counters commit together, emails go
+# out only once they have
+@database_sync_to_async
+def create_chat_message(conversation_name, from_user, text, document_ids=(), notify_always=False):
+    with transaction.atomic():
+        conversation = Conversation.objects.get(name=conversation_name)
+        last_message_in_conversation = conversation.messages.all().order_by("-created_at").first()
+        message = Message.objects.create(
+            conversation=conversation,
+            from_user=from_user,
+            message=text,
+        )
+        if notify_always or not last_message_in_conversation:
+            transaction.on_commit(lambda: send_message_notification(message))
+        elif (last_message_in_conversation.created_at - message.created_at).total_seconds() > 3600:
+            transaction.on_commit(lambda: send_message_notification(message))
+        messages = attach_documents(conversation, message, from_user, document_ids) if document_ids else [message]
+    return conversation, get_message_payloads([created_message.id for created_message in messages])
+
+# Ids come straight from the client, None when any of them is not a document id
+def get_document_ids(docs):
+    if not isinstance(docs, list):
+        return None
+    try:
+        document_ids = [int(document_id) for document_id in docs]
+    except (TypeError, ValueError):
+        return None
+    if any(document_id <= 0 for document_id in document_ids):
+        return None
+    return list(dict.fromkeys(document_ids))
+
+# Runs inside create_chat_message's transaction
+def attach_documents(conversation, message, from_user, document_ids):
+    documents = list(Document.objects.select_for_update().filter(id__in=document_ids, conversation=conversation, staging=True))
+    if not documents:
+        return [message]
+    positions = {document_id: index for index, document_id in enumerate(document_ids)}
+    documents.sort(key=lambda document: positions[document.id])
+
+    messages = [message] + Message.objects.bulk_create([
+        Message(conversation=conversation, from_user=from_user, message="")
+        for _ in documents[1:]
+    ])
+    previous_message_ids = [document.message_id for document in documents]
+    now = timezone.now()
+    for document, attached_message in zip(documents, messages):
+        document.conversation = conversation
+        document.message = attached_message
+        document.staging = False
+        document.updated_at = now
+    Document.objects.bulk_update(documents, ["message", "staging", "updated_at"])
+    # bulk_create skips post_save, count the extra messages here
+    record_new_messages(messages[1:])
+
+    transaction.on_commit(lambda: invalidate_message_payloads(previous_message_ids + [message.id]))
+    transaction.on_commit(lambda: send_documents_upload_notification(conversation, documents))
+    return messages
+
+@database_sync_to_async
+def mark_read_up_to(conversation_name, user, message_id):
+    try:
+        conversation = Conversation.objects.get(name=conversation_name)
+        return read_up_to(user, conversation, int(message_id))
+    except (Conversation.DoesNotExist, TypeError, ValueError):
+        return False
+
+async def send_read_receipt(conversation_name, user, message_id):
+    if await mark_read_up_to(conversation_name, user, message_id):
+        await apublish(conversation_name, read_receipt_event(user, int(message_id)))
+
+
+class AnonymousChatConsumer(ThrottledConsumerMixin, PresenceMixin, AsyncJsonWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.conversation = None
 
-    def connect(self):
+    async def connect(self):
         query_string = self.scope["query_string"].decode("utf-8")
         query_params = dict(parse_qsl(query_string))
         web_token = query_params["web_token"]
@@ -29,223 +150,166 @@ class AnonymousChatConsumer(JsonWebsocketConsumer):
             conversation_name = query_params["conversation_name"]
         except Exception:
             conversation_name = None
-        try: 
-            integration = Integration.objects.get(channel="web", web_token=web_token)
+        try:
+            integration = await aget_integration("web", web_token=web_token)
         except:
-            self.close()
+            await self.close()
             raise ValueError("Invalid Web Integration")
-        try:
-            if conversation_name:
-                conversation = Conversation.objects.get(name=conversation_name, user=None)
-            else:
-                new_name = ''.join(random.choices(string.ascii_uppercase + string.digits, k=16))
-                conversation = Conversation.objects.create(name=new_name, integration=integration)
-        except Conversation.DoesNotExist:
-            conversation = Conversation.objects.create(name=conversation_name, integration=integration)
+        conversation = await self.get_conversation(integration, conversation_name)
         self.conversation = conversation.name
+        # Visitors act as the shared anonymous user, which is also who agents see online
+        self.scope["user"] = await aget_anonymous_user()
 
-        self.accept()
+        await self.accept()
 
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.conversation, self.channel_name
         )
-        messages = conversation.messages.all().order_by("-created_at")[0:50]
-        self.send_json({
-            "type": "last_messages",
-            "conversation_name": self.conversation,
-            "messages": MessageSerializer(messages, many=True).data
-        })
-
-    def disconnect(self, code):
-        return super().disconnect(code)
-    
-    def receive_json(self, content, **kwargs):
+        await self.enter_conversation(self.conversation)
+        await send_last_messages(self, conversation, get_since(query_params), {"conversation_name": self.conversation})
+
+    @database_sync_to_async
+    def get_conversation(self, integration, conversation_name):
+        try:
+            if conversation_name:
+                return Conversation.objects.get(name=conversation_name, user=None)
+            new_name = ''.join(random.choices(string.ascii_uppercase + string.digits, k=16))
+            return Conversation.objects.create(name=new_name, integration=integration)
+        except Conversation.DoesNotExist:
+            return Conversation.objects.create(name=conversation_name, integration=integration)
+
+    async def disconnect(self, code):
+        await self.leave_all_conversations()
+        if self.conversation:
+            await self.channel_layer.group_discard(self.conversation, self.channel_name)
+        return await super().disconnect(code)
+
+    async def receive_json(self, content, **kwargs):
         message_type = content["type"]
+        if not await self.allow_frame(self.conversation, message_type):
+            return await self.reject_frame(message_type)
         if message_type == "chat_message":
-            conversation = Conversation.objects.get(name=self.conversation)
-            last_message_in_conversation = conversation.messages.all().order_by("-created_at").first()
-            anonymous_user = User.objects.get(profile__Anonymous=True)
-            message = Message.objects.create(
-                conversation=conversation,
-                from_user=anonymous_user,
-                message=content["message"],
-            )
-            if last_message_in_conversation:
-                if (last_message_in_conversation.created_at - message.created_at).total_seconds() > 3600:
-                    send_message_notification(message)
-            else:
-                send_message_notification(message)
- 
-            async_to_sync(self.channel_layer.group_send)(
-                self.conversation,
-                {
-                    "type": "chat_message_echo",
-                    "sender": self.scope["user"].email,
-                    "message": MessageSerializer(message).data,
-                },
-            )
-        return super().receive_json(content, **kwargs)
-    
-    def chat_message_echo(self, event):
-        self.send_json(event)
-
-class ChatConsumer(JsonWebsocketConsumer):
+            conversation, payloads = await create_chat_message(self.conversation, self.scope["user"], content["message"])
+            await apublish_messages(self.conversation, str(self.scope["user"]), payloads)
+        return await super().receive_json(content, **kwargs)
+
+    async def typing_echo(self, event):
+        await self.send_json(event)
+
+    async def chat_message_echo(self, event):
+        await self.send_json(event)
+
+    async def chat_messages_batch(self, event):
+        await self.send_json(event)
+
+    async def ai_message_delta(self, event):
+        await self.send_json(event)
+
+    async def presence(self, event):
+        await self.send_json(event)
+
+    async def read_receipt(self, event):
+        await self.send_json(event)
+
+    async def delivery_status(self, event):
+        await self.send_json(event)
+
+class ChatConsumer(ThrottledConsumerMixin, TypingIndicatorMixin, PresenceMixin, AsyncJsonWebsocketConsumer):
 
     def __init__(self, *args, **kwargs):
-        super().__init__(args, kwargs)
+        super().__init__(*args, **kwargs)
         self.conversation = None
 
-    def connect(self):
+    async def connect(self):
         try:
             query_string = self.scope["query_string"].decode("utf-8")
             query_params = dict(parse_qsl(query_string))
             ticket_uuid = query_params["ticket_uuid"]
-            suspected_user = cache.get(ticket_uuid)
-            if cache.delete(ticket_uuid):
+            suspected_user = await get_ticket_user(ticket_uuid)
+            if suspected_user:
                 self.scope["user"] = suspected_user
                 self.conversation = suspected_user.email.replace("@", ".")
             else:
                 raise ValueError("Invalid ticket!")
         except:
-            self.close()
+            await self.close()
             raise ValueError("Error getting ticket")
-        self.accept()
-        
+        await self.accept()
 
-        try:
-            integration = Integration.objects.get(channel='integrated')
-            conversation, created = Conversation.objects.get_or_create(integration=integration, name=self.conversation)
-            if created:
-                conversation.user = suspected_user
-                conversation.save()
-                send_new_conversation_notification_admins(conversation)
-        except Exception:
-            pass
-    
-        
-        
-        async_to_sync(self.channel_layer.group_add)(
+        conversation = await self.get_conversation(suspected_user)
+
+        await self.channel_layer.group_add(
             self.conversation, self.channel_name
         )
-        messages = conversation.messages.all().order_by("-created_at")[0:50]
-        self.send_json({
-            "type": "last_messages",
-            "messages": MessageSerializer(messages, many=True).data
-        })
-
-
-    def disconnect(self, code):
-        return super().disconnect(code)
-
-    def receive_json(self, content, **kwargs):
+        await self.enter_conversation(self.conversation)
+        await send_last_messages(self, conversation, get_since(query_params))
+
+    @database_sync_to_async
+    def get_conversation(self, user):
+        integration = get_integration('integrated')
+        conversation, created = Conversation.objects.get_or_create(integration=integration, name=self.conversation)
+        if created:
+            conversation.user = user
+            conversation.save()
+            send_new_conversation_notification_admins(conversation)
+        return conversation
+
+    async def disconnect(self, code):
+        await self.stop_all_typing()
+        await self.leave_all_conversations()
+        if self.conversation:
+            await self.channel_layer.group_discard(self.conversation, self.channel_name)
+        return await super().disconnect(code)
+
+    async def receive_json(self, content, **kwargs):
         message_type = content["type"]
+        if not await self.allow_frame(self.conversation, message_type):
+            return await self.reject_frame(message_type)
         if message_type == "typing":
-            async_to_sync(self.channel_layer.group_send)(
-                self.conversation,
-                {
-                    "type": "typing_echo",
-                    "sender": self.scope["user"].email,
-                    "typing": content["typing"],    
-                },
-            )
+            await self.set_typing(self.conversation, content["typing"])
+
+        if message_type == "read_up_to":
+            await send_read_receipt(self.conversation, self.scope["user"], content["message"])
 
         if message_type == "chat_message":
-            conversation = Conversation.objects.get(name=self.conversation)
-            last_message_in_conversation = conversation.messages.all().order_by("-created_at").first()
-            message = Message.objects.create(
-                conversation=conversation,
-                from_user=self.scope["user"],
-                message=content["message"],
-            )
-            if last_message_in_conversation:
-                if (last_message_in_conversation.created_at - message.created_at).total_seconds() > 3600:
-                    send_message_notification(message)
-            else:
-                send_message_notification(message)
-            docs = content["documents"]
-            if docs:
-                for index, document_id in enumerate(docs):
-                    try:
-                        document = Document.objects.get(id=document_id, conversation=conversation, staging=True)
-                        if index == 0:
-                            document.message = message
-                        else:
-                            message = Message.objects.create(
-                                conversation=conversation,
-                                from_user=self.scope["user"],
-                                message="",
-                            )
-                            document.message = message
-                        document.staging = False
-                        document.save()
-                        send_document_upload_notification(document)
-                    except:
-                        pass
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.conversation,
-                        {
-                            "type": "chat_message_echo",
-                            "sender": self.scope["user"].email,
-                            "message": MessageSerializer(message).data,
-                        },
-                    )
-            else:
-                async_to_sync(self.channel_layer.group_send)(
-                    self.conversation,
-                    {
-                        "type": "chat_message_echo",
-                        "sender": self.scope["user"].email,
-                        "message": MessageSerializer(message).data,
-                    },
-                )
+            document_ids = get_document_ids(content["documents"])
+            if document_ids is None:
+                return await reject_documents(self)
+            conversation, payloads = await create_chat_message(self.conversation, self.scope["user"], content["message"], document_ids)
+            await apublish_messages(self.conversation, self.scope["user"].email, payloads)
             if conversation.autopilot:
-                past_messages = Message.objects.filter(conversation=conversation).order_by('-created_at')[:settings.AI_CONTEXT_SIZE]
-                past_messages = past_messages[::-1]
-                past_messages = MessageSerializer(past_messages, many=True).data
-
-                try:
-                    ai_response = get_my_ai_response(past_messages)
-                    
-                    ai_user = Profile.objects.get(AI=True).user
-                    ai_message = Message.objects.create(
-                                        conversation=conversation,
-                                        from_user=ai_user,
-                                        message=ai_response,
-                                        read=False
-                                    )
-                    
-                    try:
-                        async_to_sync(self.channel_layer.group_send)(
-                            conversation.name,
-                            {
-                                'type': 'chat_message_echo',
-                                'sender': ai_user,
-                                'message': MessageSerializer(ai_message).data
-                            }
-                        )
-                    except Exception as e:
-                        print(e)
-                    
-                except Exception as e:
-                    conversation.autopilot = False
-                    conversation.save()
-                    send_conversation_autopilot_deactivated(conversation)
-
-        return super().receive_json(content, **kwargs)
-
-    def typing_echo(self, event):
-        self.send_json(event)
-
-    def chat_message_echo(self, event):
-        self.send_json(event)
-
-class AdminChatConsumer(JsonWebsocketConsumer):
+                await aenqueue(generate_autopilot_reply, conversation.id)
+
+        return await super().receive_json(content, **kwargs)
+
+    async def typing_echo(self, event):
+        await self.send_json(event)
+
+    async def chat_message_echo(self, event):
+        await self.send_json(event)
+
+    async def chat_messages_batch(self, event):
+        await self.send_json(event)
+
+    async def ai_message_delta(self, event):
+        await self.send_json(event)
+
+    async def presence(self, event):
+        await self.send_json(event)
+
+    async def read_receipt(self, event):
+        await self.send_json(event)
+
+    async def delivery_status(self, event):
+        await self.send_json(event)
+
+class AdminChatConsumer(ThrottledConsumerMixin, TypingIndicatorMixin, PresenceMixin, AsyncJsonWebsocketConsumer):
 
     def __init__(self, *args, **kwargs):
-        super().__init__(args, kwargs)
+        super().__init__(*args, **kwargs)
         self.conversation = None
 
-    def connect(self):
+    async def connect(self):
         try:
             self.conversation = self.scope["url_route"]["kwargs"]["conversation"].replace("@", ".")
         except KeyError:
@@ -255,137 +319,177 @@ class AdminChatConsumer(JsonWebsocketConsumer):
             query_string = self.scope["query_string"].decode("utf-8")
             query_params = dict(parse_qsl(query_string))
             ticket_uuid = query_params["ticket_uuid"]
-            suspected_user = cache.get(ticket_uuid)
-            if cache.delete(ticket_uuid) and suspected_user.profile.admin:
+            suspected_user = await get_ticket_user(ticket_uuid, admin=True)
+            if suspected_user:
                 self.scope["user"] = suspected_user
             else:
                 raise ValueError("Invalid ticket!")
         except:
-            self.close()
+            await self.close()
             raise ValueError("Error getting ticket")
 
         try:
-            conversation = Conversation.objects.get(name=self.conversation)
+            conversation = await Conversation.objects.aget(name=self.conversation)
         except Conversation.DoesNotExist:
-            self.close()
+            await self.close()
             raise ValueError("Conversation not found!")
 
-        self.accept()
-        
-        async_to_sync(self.channel_layer.group_add)(
+        await self.accept()
+
+        await self.channel_layer.group_add(
             self.conversation, self.channel_name
         )
-        messages = conversation.messages.all().order_by("-created_at")[0:50]
-        self.send_json({
-            "type": "last_messages",
-            "messages": MessageSerializer(messages, many=True).data
-        })
-
-    def disconnect(self, code):
-        return super().disconnect(code)
-
-    def receive_json(self, content, **kwargs):
+        await self.enter_conversation(self.conversation)
+        await send_last_messages(self, conversation, get_since(query_params))
+
+    async def disconnect(self, code):
+        await self.stop_all_typing()
+        await self.leave_all_conversations()
+        if self.conversation:
+            await self.channel_layer.group_discard(self.conversation, self.channel_name)
+        return await super().disconnect(code)
+
+    async def receive_json(self, content, **kwargs):
+        if not await self.allow_frame(self.conversation, content["type"]):
+            return await self.reject_frame(content["type"])
+        await self.handle_frame(self.conversation, content)
+        return await super().receive_json(content, **kwargs)
+
+    async def handle_frame(self, conversation_name, content):
         message_type = content["type"]
         if message_type == "typing":
-            async_to_sync(self.channel_layer.group_send)(
-                self.conversation,
-                {
-                    "type": "typing_echo",
-                    "sender": self.scope["user"].email,
-                    "typing": content["typing"],    
-                },
-            )
+            await self.set_typing(conversation_name, content["typing"])
+
+        if message_type == "read_up_to":
+            await send_read_receipt(conversation_name, self.scope["user"], content["message"])
 
         if message_type == "chat_message":
-            conversation = Conversation.objects.get(name=self.conversation)
-            message = Message.objects.create(
-                conversation=conversation,
-                from_user=self.scope["user"],
-                message=content["message"],
-            )
-            send_message_notification(message)
-            docs = content["documents"]
-            if docs:
-                for index, document_id in enumerate(docs):
-                    try:
-                        document = Document.objects.get(id=document_id, conversation=conversation, staging=True)
-                        if index == 0:
-                            document.message = message
-                        else:
-                            message = Message.objects.create(
-                                conversation=conversation,
-                                from_user=self.scope["user"],
-                                message="",
-                            )
-                            document.message = message
-                        document.staging = False
-                        document.save()
-                        send_document_upload_notification(document)
-                    except:
-                        pass
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.conversation,
-                        {
-                            "type": "chat_message_echo",
-                            "sender": self.scope["user"].email,
-                            "message": MessageSerializer(message).data,
-                        },
-                    )
-            else:
-                async_to_sync(self.channel_layer.group_send)(
-                    self.conversation,
-                    {
-                        "type": "chat_message_echo",
-                        "sender": self.scope["user"].email,
-                        "message": MessageSerializer(message).data,
-                    },
-                )
+            document_ids = get_document_ids(content["documents"])
+            if document_ids is None:
+                return await reject_documents(self)
+            conversation, payloads = await create_chat_message(conversation_name, self.scope["user"], content["message"], document_ids, notify_always=True)
+            await apublish_messages(conversation_name, self.scope["user"].email, payloads)
+
         if message_type == "request_payment":
-            conversation = Conversation.objects.get(name=self.conversation)
-            message = Message.objects.create(
-                conversation=conversation,
-                from_user=self.scope["user"],
-                message=None
-            )
-            payment = Payment.objects.create(
-                conversation=conversation,
-                message=message,
-                description=content["description"],
-                amount_cents=content["amount"],
-            )
-            send_payment_requested_notification(payment)
-            async_to_sync(self.channel_layer.group_send)(
-                self.conversation,
-                {
-                    "type": "chat_message_echo",
-                    "sender": self.scope["user"].email,
-                    "message": MessageSerializer(message).data
-                }
-            )
+            payload = await self.request_payment(conversation_name, content["description"], content["amount"])
+            await apublish_messages(conversation_name, self.scope["user"].email, [payload])
 
         if message_type == "request_document":
-            conversation = Conversation.objects.get(name=self.conversation)
-            message = Message.objects.create(
-                conversation=conversation,
-                from_user=self.scope["user"],
-                message=None
-            )
-            document = Document.objects.create(
-                conversation=conversation,
-                message=message,
-                requirement=content["document"]
-            )
-            send_document_requested_notification(document)
-            async_to_sync(self.channel_layer.group_send)(
-                self.conversation,
-                {
-                    "type": "chat_message_echo",
-                    "sender": self.scope["user"].email,
-                    "message": MessageSerializer(message).data
-                }
-            )
-        
-        return super().receive_json(content, **kwargs)
-
-    def chat_message_echo(self, event):
-        self.send_json(event)
\ No newline at end of file
+            payload = await self.request_document(conversation_name, content["document"])
+            await apublish_messages(conversation_name, self.scope["user"].email, [payload])
+
+    @database_sync_to_async
+    def request_payment(self, conversation_name, description, amount):
+        conversation = Conversation.objects.get(name=conversation_name)
+        message = Message.objects.create(
+            conversation=conversation,
+            from_user=self.scope["user"],
+            message=None
+        )
+        payment = Payment.objects.create(
+            conversation=conversation,
+            message=message,
+            description=description,
+            amount_cents=amount,
+        )
+        send_payment_requested_notification(payment)
+        return get_message_payload(message.id)
+
+    @database_sync_to_async
+    def request_document(self, conversation_name, requirement):
+        conversation = Conversation.objects.get(name=conversation_name)
+        message = Message.objects.create(
+            conversation=conversation,
+            from_user=self.scope["user"],
+            message=None
+        )
+        document = Document.objects.create(
+            conversation=conversation,
+            message=message,
+            requirement=requirement
+        )
+        send_document_requested_notification(document)
+        return get_message_payload(message.id)
+
+    async def typing_echo(self, event):
+        await self.send_json(event)
+
+    async def chat_message_echo(self, event):
+        await self.send_json(event)
+
+    async def chat_messages_batch(self, event):
+        await self.send_json(event)
+
+    async def ai_message_delta(self, event):
+        await self.send_json(event)
+
+    async def presence(self, event):
+        await self.send_json(event)
+
+    async def read_receipt(self, event):
+        await self.send_json(event)
+
+    async def delivery_status(self, event):
+        await self.send_json(event)
+
+class AdminInboxConsumer(AdminChatConsumer):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscriptions = set()
+
+    async def connect(self):
+        try:
+            query_string = self.scope["query_string"].decode("utf-8")
+            query_params = dict(parse_qsl(query_string))
+            ticket_uuid = query_params["ticket_uuid"]
+            suspected_user = await get_ticket_user(ticket_uuid, admin=True)
+            if suspected_user:
+                self.scope["user"] = suspected_user
+            else:
+                raise ValueError("Invalid ticket!")
+        except:
+            await self.close()
+            raise ValueError("Error getting ticket")
+
+        await self.accept()
+        await self.channel_layer.group_add(INBOX_GROUP, self.channel_name)
+
+    async def disconnect(self, code):
+        for conversation_name in self.subscriptions:
+            await self.channel_layer.group_discard(conversation_name, self.channel_name)
+        self.subscriptions.clear()
+        await self.channel_layer.group_discard(INBOX_GROUP, self.channel_name)
+        return await super().disconnect(code)
+
+    async def receive_json(self, content, **kwargs):
+        message_type = content["type"]
+        conversation_name = content.get("conversation")
+        if not await self.allow_frame(conversation_name, message_type):
+            return await self.reject_frame(message_type)
+        if message_type == "subscribe":
+            await self.subscribe(conversation_name, get_since(content))
+        elif message_type == "unsubscribe":
+            await self.unsubscribe(conversation_name)
+        elif conversation_name in self.subscriptions:
+            await self.handle_frame(conversation_name, content)
+
+    async def subscribe(self, conversation_name, since=None):
+        conversation = await Conversation.objects.filter(name=conversation_name).afirst()
+        if conversation is None or len(self.subscriptions) >= settings.INBOX_MAX_SUBSCRIPTIONS:
+            await self.send_json({"type": "subscribe_error", "conversation": conversation_name})
+            return
+        self.subscriptions.add(conversation_name)
+        await self.channel_layer.group_add(conversation_name, self.channel_name)
+        await self.enter_conversation(conversation_name)
+        await send_last_messages(self, conversation, since, {"conversation": conversation_name})
+
+    async def unsubscribe(self, conversation_name):
+        if conversation_name in self.subscriptions:
+            self.subscriptions.discard(conversation_name)
+            await self.channel_layer.group_discard(conversation_name, self.channel_name)
+            await self.leave_conversation(conversation_name)
+
+    async def inbox_notification(self, event):
+        if event["conversation"] not in self.subscriptions:
+            await self.send_json(event)
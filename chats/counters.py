@@ -0,0 +1,145 @@
+from collections import defaultdict
+
+from django.db.models import BigIntegerField, Case, Count, DateTimeField, F, Max, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+from .models import Conversation, Message, ReadCursor
+from .registry import get_anonymous_user
+
+User = get_user_model()
+
+# Conversations being torn down by chats.deletion, their messages need no bookkeeping
+paused_conversations = set()
+
+
+# Messages from the customer side are unread by the admins, everything else
+# (admins, autopilot) is unread by the customer. Anonymous web chats have no
+# conversation.user, their customer messages come from the anonymous user.
+def get_anonymous_user_id():
+    try:
+        return get_anonymous_user().id
+    except User.DoesNotExist:
+        return None
+
+def is_customer(user_id, conversation_user_id):
+    if conversation_user_id is not None:
+        return user_id == conversation_user_id
+    return user_id == get_anonymous_user_id()
+
+def is_customer_message(message, conversation_user_id):
+    return is_customer(message.from_user_id, conversation_user_id)
+
+def get_conversation_user_ids(messages):
+    user_ids = {}
+    missing = set()
+    for message in messages:
+        if Message.conversation.is_cached(message):
+            user_ids[message.conversation_id] = message.conversation.user_id
+        else:
+            missing.add(message.conversation_id)
+    missing -= set(user_ids)
+    if missing:
+        user_ids.update(Conversation.objects.filter(id__in=missing).values_list("id", "user_id"))
+    return user_ids
+
+def count_unread(messages, user_ids):
+    counts = defaultdict(lambda: {"unread_by_admins": 0, "unread_by_user": 0})
+    for message in messages:
+        side = "unread_by_admins" if is_customer_message(message, user_ids.get(message.conversation_id)) else "unread_by_user"
+        counts[message.conversation_id][side] += 1
+    return counts
+
+def record_new_messages(messages):
+    messages = [message for message in messages if message.pk]
+    if not messages:
+        return
+    user_ids = get_conversation_user_ids(messages)
+    unread = count_unread([message for message in messages if not message.read], user_ids)
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_id].append(message)
+
+    now = timezone.now()
+    for conversation_id, conversation_messages in by_conversation.items():
+        latest = max(conversation_messages, key=lambda message: (message.created_at, message.pk))
+        # A slower writer must not replace a newer last message
+        newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=latest.created_at)
+        Conversation.objects.filter(id=conversation_id).update(
+            last_message=Case(When(newer, then=Value(latest.pk)), default=F("last_message"), output_field=BigIntegerField()),
+            last_message_at=Case(When(newer, then=Value(latest.created_at)), default=F("last_message_at"), output_field=DateTimeField()),
+            unread_by_admins=F("unread_by_admins") + unread[conversation_id]["unread_by_admins"],
+            unread_by_user=F("unread_by_user") + unread[conversation_id]["unread_by_user"],
+            updated_at=now,
+        )
+
+def refresh_unread(conversation_ids):
+    Conversation.objects.filter(id__in=conversation_ids).update(
+        unread_by_admins=unread_count(customer=True),
+        unread_by_user=unread_count(customer=False),
+    )
+
+def record_read_messages(messages):
+    refresh_unread({message.conversation_id for message in messages})
+
+def record_deleted_message(message):
+    if message.conversation_id in paused_conversations:
+        return
+    if not message.read:
+        refresh_unread([message.conversation_id])
+    # Deleting the last message nulls the foreign key, fall back to the one before it
+    Conversation.objects.filter(id=message.conversation_id, last_message__isnull=True).update(
+        last_message=Subquery(last_message_queryset().values("id")[:1]),
+        last_message_at=Subquery(last_message_queryset().values("created_at")[:1]),
+    )
+
+def last_message_queryset():
+    return Message.objects.filter(conversation=OuterRef("pk")).order_by("-created_at", "-id")
+
+# Rows of a model with a conversation foreign key whose user_field is on the customer side
+def side_filter(customer, user_field):
+    anonymous_user_id = get_anonymous_user_id()
+    identified = Q(conversation__user__isnull=False)
+    anonymous = Q(conversation__user__isnull=True)
+    own = Q(**{user_field: F("conversation__user")})
+    visitor = Q(**{user_field: anonymous_user_id})
+    if customer:
+        return (identified & own) | (anonymous & visitor)
+    return (identified & ~own) | (anonymous & ~visitor)
+
+def read_cursor(customer):
+    cursors = ReadCursor.objects.filter(side_filter(customer, "user"), conversation=OuterRef("conversation"))
+    return Coalesce(Subquery(cursors.order_by().values("conversation").annotate(last=Max("last_read_message_id")).values("last")), 0)
+
+# Messages sent by one side that the other side has neither flagged as read
+# nor moved its furthest read cursor past
+def unread_count(customer):
+    messages = Message.objects.filter(side_filter(customer, "from_user"), conversation=OuterRef("pk"), read=False, id__gt=read_cursor(not customer))
+    return Coalesce(Subquery(messages.order_by().values("conversation").annotate(total=Count("id")).values("total")), 0)
+
+def read_up_to(user, conversation, message_id):
+    if not Message.objects.filter(conversation=conversation, id=message_id).exists():
+        return False
+    moved = ReadCursor.objects.filter(conversation=conversation, user=user, last_read_message_id__lt=message_id).update(
+        last_read_message_id=message_id, updated_at=timezone.now()
+    )
+    if not moved:
+        cursor, moved = ReadCursor.objects.get_or_create(conversation=conversation, user=user, defaults={"last_read_message_id": message_id})
+        if not moved:
+            return False
+    if is_customer(user.id, conversation.user_id):
+        Conversation.objects.filter(id=conversation.id).update(unread_by_user=unread_count(customer=False))
+    else:
+        Conversation.objects.filter(id=conversation.id).update(unread_by_admins=unread_count(customer=True))
+    return True
+
+def rebuild_conversation_counters(conversations=None):
+    if conversations is None:
+        conversations = Conversation.objects.all()
+    return conversations.update(
+        last_message=Subquery(last_message_queryset().values("id")[:1]),
+        last_message_at=Subquery(last_message_queryset().values("created_at")[:1]),
+        unread_by_admins=unread_count(customer=True),
+        unread_by_user=unread_count(customer=False),
+    )
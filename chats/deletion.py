@@ -0,0 +1,102 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .counters import paused_conversations
+from .models import Conversation, Message, Document, Payment
+from .redis_client import get_redis
+
+
+def progress_key(conversation_id):
+    return f"deletion:{conversation_id}"
+
+def set_progress(conversation_id, **fields):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(progress_key(conversation_id), mapping={**fields, "updated_at": time.time()})
+        pipe.expire(progress_key(conversation_id), settings.DELETION_PROGRESS_TIMEOUT)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(e)
+
+def add_progress(conversation_id, field, amount):
+    try:
+        get_redis().hincrby(progress_key(conversation_id), field, amount)
+    except redis.RedisError as e:
+        print(e)
+
+def get_deletion_progress(conversation_id):
+    try:
+        progress = get_redis().hgetall(progress_key(conversation_id))
+    except redis.RedisError as e:
+        print(e)
+        return None
+    if not progress:
+        return None
+    progress = {key.decode(): value.decode() for key, value in progress.items()}
+    return {key: value if key == "state" else float(value) if key == "updated_at" else int(value) for key, value in progress.items()}
+
+def mark_for_deletion(conversation_id):
+    return Conversation.objects.filter(id=conversation_id, pending_deletion=False).update(pending_deletion=True) > 0
+
+def delete_blob(name):
+    try:
+        default_storage.delete(name)
+        return True
+    except Exception as e:
+        print(e)
+        return False
+
+def delete_documents(conversation_id, batch_size):
+    with ThreadPoolExecutor(max_workers=settings.DELETION_BLOB_WORKERS) as pool:
+        while True:
+            batch = list(Document.objects.filter(conversation_id=conversation_id).order_by("id").values_list("id", "file")[:batch_size])
+            if not batch:
+                return
+            names = [name for document_id, name in batch if name]
+            failed = list(pool.map(delete_blob, names)).count(False)
+            Document.objects.filter(id__in=[document_id for document_id, name in batch]).delete()
+            add_progress(conversation_id, "documents", len(batch))
+            if failed:
+                # The rows go anyway, a stuck blob must not keep the conversation around
+                add_progress(conversation_id, "blob_errors", failed)
+
+def delete_rows(conversation_id, model, field, batch_size):
+    while True:
+        ids = list(model.objects.filter(conversation_id=conversation_id).order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return
+        model.objects.filter(id__in=ids).delete()
+        add_progress(conversation_id, field, len(ids))
+
+# Every step runs in its own short transaction, so locks are held per batch and
+# a crashed run picks up where it stopped when the job is enqueued again
+def delete_conversation(conversation_id):
+    conversation = Conversation.objects.filter(id=conversation_id, pending_deletion=True).first()
+    if not conversation:
+        return
+    batch_size = settings.DELETION_BATCH_SIZE
+    set_progress(
+        conversation_id,
+        state="running",
+        total_documents=Document.objects.filter(conversation_id=conversation_id).count(),
+        total_payments=Payment.objects.filter(conversation_id=conversation_id).count(),
+        total_messages=Message.objects.filter(conversation_id=conversation_id).count(),
+        documents=0, payments=0, messages=0, blob_errors=0,
+    )
+    paused_conversations.add(conversation_id)
+    try:
+        delete_documents(conversation_id, batch_size)
+        delete_rows(conversation_id, Payment, "payments", batch_size)
+        Conversation.objects.filter(id=conversation_id).update(last_message=None)
+        delete_rows(conversation_id, Message, "messages", batch_size)
+        conversation.delete()
+    except Exception:
+        set_progress(conversation_id, state="failed")
+        raise
+    finally:
+        paused_conversations.discard(conversation_id)
+    set_progress(conversation_id, state="done")
@@ -0,0 +1,144 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Message
+from .events import publish, delivery_status_event
+from .redis_client import get_redis
+from .throttling import consume
+from .whatsapp import send_whatsapp
+from .telegram import send_telegram
+
+logger = logging.getLogger(__name__)
+
+# Outbound replies wait in a Redis sorted set scored by when they are due. The
+# message row holds the status, so anything lost from Redis is found again
+# by recover_deliveries when the workers start.
+
+QUEUE_KEY = "delivery:queue"
+
+# Senders skip the HTTP client's status retries, deliver throttles and backs off itself
+SENDERS = {
+    "whatsapp": send_whatsapp,
+    "telegram": send_telegram,
+}
+
+
+def queue_delivery(message_id, delay=0):
+    try:
+        get_redis().zadd(QUEUE_KEY, {message_id: time.time() + delay})
+    except redis.RedisError:
+        logger.exception("Could not queue delivery of message %s", message_id)
+        raise
+
+def recover_deliveries():
+    message_ids = list(Message.objects.filter(delivery_status="queued").values_list("id", flat=True))
+    if message_ids:
+        # nx keeps the due time of retries that are still scheduled
+        get_redis().zadd(QUEUE_KEY, {message_id: time.time() for message_id in message_ids}, nx=True)
+    return len(message_ids)
+
+def pop_due():
+    client = get_redis()
+    popped = client.zpopmin(QUEUE_KEY)
+    if not popped:
+        return None, None
+    member, due = popped[0]
+    if due > time.time():
+        client.zadd(QUEUE_KEY, {member: due}, nx=True)
+        return None, due
+    return int(member), due
+
+# Seconds until both the channel and the recipient bucket have a token, 0 when sending now
+def throttle_delay(channel, recipient):
+    limits = settings.DELIVERY_RATE_LIMITS.get(channel, {})
+    for key, scope in ((f"delivery:{channel}", "channel"), (f"delivery:{channel}:{recipient}", "recipient")):
+        if scope in limits:
+            rate, burst = limits[scope]
+            if not consume(key, rate, burst):
+                return 1 / rate
+    return 0
+
+def backoff(attempts, retry_after=None):
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    delay = min(settings.DELIVERY_BACKOFF_MAX, settings.DELIVERY_BACKOFF * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+def deliver(message_id):
+    message = Message.objects.select_related("conversation__integration").filter(id=message_id, delivery_status="queued").first()
+    if not message:
+        return
+    conversation = message.conversation
+    channel = conversation.integration.channel
+    delay = throttle_delay(channel, conversation.name)
+    if delay:
+        queue_delivery(message_id, delay)
+        return
+
+    retry_after = None
+    # A timeout can hide a send that went through, delivery is at least once
+    try:
+        response = SENDERS[channel](conversation.name, message.message)
+        retry = response.status_code == 429 or response.status_code >= 500
+        error = None if response.ok else f"{response.status_code} {response.text}"
+        retry_after = response.headers.get("Retry-After")
+    except requests.RequestException as e:
+        retry = True
+        error = str(e)
+
+    message.delivery_attempts += 1
+    message.delivery_error = error[:255] if error else None
+    if not error:
+        message.delivery_status = "sent"
+    elif not retry or message.delivery_attempts >= settings.DELIVERY_MAX_ATTEMPTS:
+        message.delivery_status = "failed"
+    message.save(update_fields=["delivery_status", "delivery_attempts", "delivery_error"])
+
+    if message.delivery_status == "queued":
+        queue_delivery(message_id, backoff(message.delivery_attempts, retry_after))
+        return
+    try:
+        publish(conversation.name, delivery_status_event(message))
+    except Exception:
+        logger.exception("Could not publish delivery status of message %s", message_id)
+
+def delivery_loop(poll, burst):
+    while True:
+        try:
+            message_id, due = pop_due()
+        except redis.RedisError:
+            logger.exception("Could not pop due deliveries")
+            time.sleep(poll)
+            continue
+        if message_id is None:
+            if burst and due is None:
+                return
+            time.sleep(max(0, min(poll, due - time.time())) if due else poll)
+            continue
+        close_old_connections()
+        try:
+            deliver(message_id)
+        except Exception:
+            logger.exception("Delivery of message %s failed", message_id)
+            # Popped already, put it back after the longest regular backoff.
+            # deliver skips it if the send went through before the failure.
+            try:
+                queue_delivery(message_id, backoff(settings.DELIVERY_MAX_ATTEMPTS))
+            except redis.RedisError:
+                # Logged by queue_delivery, recover_deliveries finds it on the next start
+                pass
+        finally:
+            close_old_connections()
+
+def work_deliveries(workers, poll=1, burst=False):
+    recover_deliveries()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(delivery_loop, poll, burst) for _ in range(workers)]:
+            future.result()
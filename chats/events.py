@@ -0,0 +1,57 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+# Every admin inbox socket joins this group to hear about conversations it has not opened
+INBOX_GROUP = "admin-inbox"
+
+
+def inbox_notification_event(conversation_name, payload):
+    return {
+        "type": "inbox_notification",
+        "conversation": conversation_name,
+        "message_id": payload["id"],
+        "preview": (payload["message"] or "")[:100],
+        "created_at": payload["created_at"],
+    }
+
+def read_receipt_event(user, message_id):
+    return {
+        "type": "read_receipt",
+        "user": user.id,
+        "sender": user.email,
+        "message_id": message_id,
+    }
+
+def delivery_status_event(message):
+    return {
+        "type": "delivery_status",
+        "message_id": message.id,
+        "status": message.delivery_status,
+    }
+
+async def apublish(conversation_name, event):
+    await get_channel_layer().group_send(conversation_name, {**event, "conversation": conversation_name})
+
+def publish(conversation_name, event):
+    async_to_sync(apublish)(conversation_name, event)
+
+async def apublish_messages(conversation_name, sender, payloads, **extra):
+    if len(payloads) == 1:
+        await apublish(conversation_name, {
+            "type": "chat_message_echo",
+            "sender": sender,
+            "message": payloads[0],
+            **extra,
+        })
+    elif payloads:
+        await apublish(conversation_name, {
+            "type": "chat_messages_batch",
+            "sender": sender,
+            "messages": payloads,
+            **extra,
+        })
+    if payloads:
+        await get_channel_layer().group_send(INBOX_GROUP, inbox_notification_event(conversation_name, payloads[-1]))
+
+def publish_messages(conversation_name, sender, payloads, **extra):
+    async_to_sync(apublish_messages)(conversation_name, sender, payloads, **extra)
@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from channels.db import database_sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+
+from .models import Conversation, Message
+from .tickets import aconsume_ticket
+
+EXPORT_FORMATS = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+EXPORT_COLUMNS = {
+    "id": "id",
+    "conversation_id": "conversation",
+    "conversation__name": "conversation_name",
+    "conversation__integration__channel": "channel",
+    "from_user_id": "from_user",
+    "from_user__email": "from_email",
+    "message": "message",
+    "image": "image",
+    "document__name": "document",
+    "payment__description": "payment",
+    "payment__amount_cents": "payment_amount_cents",
+    "read": "read",
+    "created_at": "created_at",
+}
+
+
+def export_conversation_ids(filters):
+    if filters.get("conversation"):
+        return [filters["conversation"]]
+    conversations = Conversation.objects.all()
+    if filters.get("created_after"):
+        conversations = conversations.filter(created_at__gte=parse_datetime(filters["created_after"]))
+    if filters.get("created_before"):
+        conversations = conversations.filter(created_at__lt=parse_datetime(filters["created_before"]))
+    return list(conversations.order_by("created_at", "id").values_list("id", flat=True))
+
+# Each batch is its own short query walking the (conversation, created_at, id)
+# index from the last row sent, so no cursor or transaction stays open while
+# a slow client downloads
+def fetch_batch(conversation_id, after=None):
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    if after:
+        created_at, message_id = after
+        messages = messages.filter(created_at__gte=created_at).exclude(created_at=created_at, id__lte=message_id)
+    rows = messages.order_by("created_at", "id").values(*EXPORT_COLUMNS)[:settings.EXPORT_CHUNK_SIZE]
+    return [{column: row[field] for field, column in EXPORT_COLUMNS.items()} for row in rows]
+
+def encode_jsonl(rows):
+    return "".join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n" for row in rows).encode()
+
+def encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(EXPORT_COLUMNS.values()))
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+def export_filename(filters, export_format):
+    if filters.get("conversation"):
+        return f"conversation-{filters['conversation']}.{export_format}"
+    return f"conversations-{(filters.get('created_after') or 'start')[:10]}-{(filters.get('created_before') or 'now')[:10]}.{export_format}"
+
+
+# Django 4.1 iterates StreamingHttpResponse synchronously on the event loop,
+# where the ORM refuses to run, so exports are served by this consumer and
+# every batch is fetched in the database thread pool instead
+class ExportConsumer(AsyncHttpConsumer):
+
+    async def handle(self, body):
+        claims = await aconsume_ticket(self.scope["url_route"]["kwargs"]["ticket"])
+        if not claims or not claims.get("admin") or "export" not in claims:
+            return await self.send_response(401, b"Invalid ticket", headers=[(b"Content-Type", b"text/plain")])
+
+        filters = claims["export"]
+        export_format = filters["format"]
+        encode = encode_jsonl if export_format == "jsonl" else encode_csv
+        await self.send_headers(status=200, headers=[
+            (b"Content-Type", EXPORT_FORMATS[export_format].encode()),
+            (b"Content-Disposition", f'attachment; filename="{export_filename(filters, export_format)}"'.encode()),
+        ])
+        if export_format == "csv":
+            await self.send_body(encode_csv([], header=True), more_body=True)
+
+        conversation_ids = await database_sync_to_async(export_conversation_ids)(filters)
+        for conversation_id in conversation_ids:
+            after = None
+            while True:
+                rows = await database_sync_to_async(fetch_batch)(conversation_id, after)
+                if not rows:
+                    break
+                after = (rows[-1]["created_at"], rows[-1]["id"])
+                await self.send_body(encode(rows), more_body=True)
+                if len(rows) < settings.EXPORT_CHUNK_SIZE:
+                    break
+        await self.send_body(b"")
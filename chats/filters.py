@@ -0,0 +1,52 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def get_bool_param(query_params, name):
+    value = query_params.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(f"Invalid {name}")
+
+def get_datetime_param(query_params, name):
+    value = query_params.get(name)
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid {name}")
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def get_fields_param(query_params):
+    fields = query_params.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+# ?created_after is inclusive and ?created_before exclusive, both take a date or a datetime
+def filter_created_at(queryset, query_params):
+    created_after = get_datetime_param(query_params, 'created_after')
+    created_before = get_datetime_param(query_params, 'created_before')
+    if created_after:
+        queryset = queryset.filter(created_at__gte=created_after)
+    if created_before:
+        queryset = queryset.filter(created_at__lt=created_before)
+    return queryset
+
+def filter_flags(queryset, query_params, flags):
+    for flag in flags:
+        value = get_bool_param(query_params, flag)
+        if value is not None:
+            queryset = queryset.filter(**{flag: value})
+    return queryset
@@ -0,0 +1,71 @@
+import random
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    # A 502 or 504 can come back after the upstream already took a POST, only
+    # the statuses that say it was turned away are safe to send again
+    POST_RETRY_STATUSES = frozenset({429, 503})
+
+    # urllib3 1.26 has no backoff jitter, without it every reply throttled by
+    # the same 429 comes back at the same moment
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST" and status_code not in self.POST_RETRY_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+# Only retries what cannot have been delivered: connection failures, and the
+# statuses providers use to turn requests away (for POST only 429 and 503).
+# A read timeout after a POST is never retried, the message may already have
+# gone out. Callers with their own retry policy turn status retries off and
+# get the 429 or 503 back right away.
+def build_session(status_retries=True):
+    retry = JitteredRetry(
+        total=settings.HTTP_RETRIES,
+        connect=settings.HTTP_RETRIES,
+        read=0,
+        status=settings.HTTP_RETRIES if status_retries else 0,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=settings.HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# One session per process and retry policy, its pools keep connections to
+# each host alive between calls instead of paying a TCP and TLS handshake every time
+def get_session(status_retries=True):
+    session = _sessions.get(status_retries)
+    if session is None:
+        with _lock:
+            session = _sessions.get(status_retries)
+            if session is None:
+                session = _sessions[status_retries] = build_session(status_retries)
+    return session
+
+def request(method, url, timeout=None, status_retries=True, **kwargs):
+    if timeout is None:
+        timeout = (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+    return get_session(status_retries).request(method, url, timeout=timeout, **kwargs)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
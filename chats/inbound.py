@@ -0,0 +1,143 @@
+import time
+from collections import defaultdict
+
+import requests
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import Conversation, Message, Profile, Integration
+from .counters import record_new_messages
+from .events import publish_messages
+from .jobs import enqueue
+from .ledger import record_events, release_events
+from .payloads import get_message_payloads
+from .registry import get_integration
+from .tasks import generate_autopilot_reply
+from .telegram import get_updates
+
+User = get_user_model()
+
+
+def validate_whatsapp_delivery(data):
+    if not isinstance(data, dict) or not isinstance(data.get("entry"), list):
+        return "Entry not found"
+    for entry in data["entry"]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("changes"), list):
+            return "Changes not found"
+        for change in entry["changes"]:
+            if not isinstance(change, dict) or not isinstance(change.get("value"), dict):
+                return "Value not found"
+    return None
+
+# Status updates arrive on the same webhook without any messages, only text
+# messages are stored
+def whatsapp_messages(data):
+    return [
+        {"event_id": message["id"], "sender": message["from"], "text": message["text"]["body"]}
+        for entry in data["entry"]
+        for change in entry["changes"]
+        for message in change["value"].get("messages", [])
+        if isinstance(message, dict) and "id" in message and "from" in message and isinstance(message.get("text"), dict) and "body" in message["text"]
+    ]
+
+def telegram_messages(updates):
+    return [
+        {"event_id": str(update["update_id"]), "sender": str(update["message"]["chat"]["id"]), "text": update["message"]["text"]}
+        for update in updates
+        if "update_id" in update and "text" in update.get("message", {})
+    ]
+
+def resolve_users(phones):
+    users = {}
+    for user in User.objects.filter(phone__in=phones).order_by("-id"):
+        users[user.phone] = user
+    missing = [phone for phone in phones if phone not in users]
+    if missing:
+        # bulk_create skips the post_save hook that gives every user a profile
+        User.objects.bulk_create([User(phone=phone) for phone in missing])
+        created = list(User.objects.filter(phone__in=missing, profile__isnull=True))
+        Profile.objects.bulk_create([Profile(user=user) for user in created])
+        users.update({user.phone: user for user in created})
+    return users
+
+def resolve_conversations(channel, users):
+    integration = get_integration(channel, create=True)
+    keys = {(phone, user.id) for phone, user in users.items()}
+    conversations = {
+        (conversation.name, conversation.user_id): conversation
+        for conversation in Conversation.objects.filter(name__in=list(users), integration__channel=channel, user__in=list(users.values()))
+    }
+    missing = [key for key in keys if key not in conversations]
+    if missing:
+        Conversation.objects.bulk_create([Conversation(name=name, integration=integration, user_id=user_id) for name, user_id in missing])
+        for conversation in Conversation.objects.filter(name__in=[name for name, user_id in missing], integration=integration):
+            conversations.setdefault((conversation.name, conversation.user_id), conversation)
+    return {phone: conversations[(phone, user.id)] for phone, user in users.items()}
+
+# One delivery can carry many messages for many senders: users, conversations
+# and messages are each written with a single bulk insert, in delivery order
+def ingest_messages(channel, items):
+    if not items:
+        return []
+    items = list({item["event_id"]: item for item in items}.values())
+    with transaction.atomic():
+        fresh = set(record_events(channel, [item["event_id"] for item in items]))
+        items = [item for item in items if item["event_id"] in fresh]
+        if not items:
+            return []
+        phones = list(dict.fromkeys(item["sender"] for item in items))
+        users = resolve_users(phones)
+        conversations = resolve_conversations(channel, users)
+        messages = Message.objects.bulk_create([
+            Message(conversation=conversations[item["sender"]], from_user=users[item["sender"]], message=item["text"], read=False)
+            for item in items
+        ])
+        record_new_messages(messages)
+
+    payloads = {payload["id"]: payload for payload in get_message_payloads([message.id for message in messages])}
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_id].append(message)
+    for conversation_messages in by_conversation.values():
+        conversation = conversation_messages[0].conversation
+        try:
+            publish_messages(conversation.name, conversation_messages[0].from_user.phone, [payloads[message.id] for message in conversation_messages])
+        except Exception as e:
+            print(e)
+        if conversation.autopilot:
+            enqueue(generate_autopilot_reply, conversation.id)
+    return messages
+
+def process_whatsapp_delivery(data):
+    items = whatsapp_messages(data)
+    try:
+        ingest_messages("whatsapp", items)
+    except Exception:
+        # The webhook claimed these before queueing the job, a redelivery must not be dropped
+        release_events("whatsapp", [item["event_id"] for item in items])
+        raise
+
+# The offset is saved only after a batch is stored, a crash in between makes
+# Telegram resend the batch and the ledger drops what was already stored
+def poll_telegram(timeout, limit=100, once=False):
+    integration = get_integration("telegram", create=True)
+    offset = Integration.objects.values_list("telegram_offset", flat=True).get(id=integration.id)
+    failures = 0
+    while True:
+        try:
+            updates = get_updates(offset, timeout, limit)
+            failures = 0
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(e)
+            if once:
+                return
+            failures += 1
+            time.sleep(min(2 ** failures, 60))
+            continue
+        if updates:
+            ingest_messages("telegram", telegram_messages(updates))
+            offset = updates[-1]["update_id"] + 1
+            Integration.objects.filter(id=integration.id).update(telegram_offset=offset)
+        if once:
+            return
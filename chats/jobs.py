@@ -0,0 +1,230 @@
+import json
+import heapq
+import logging
+import queue
+import random
+import threading
+import time
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Moves the retries that are due to the queue and returns when the next one is
+PROMOTE_RETRIES = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, payload in ipairs(due) do
+    redis.call('ZREM', KEYS[1], payload)
+    redis.call('LPUSH', KEYS[2], payload)
+end
+return redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')[2]
+"""
+
+
+# A popped job moves atomically to the worker's own processing list and only
+# leaves it once it ran or was given up on. Every worker keeps a heartbeat
+# key alive, the processing list of a worker whose heartbeat expired is put
+# back on the queue by the next worker that starts. Failed jobs wait in a
+# sorted set scored by when they are due to run again.
+class RedisBackend:
+    def __init__(self, name):
+        self.name = name
+        self.worker = uuid4().hex
+        self.heartbeat = None
+
+    @property
+    def workers_key(self):
+        return f"{self.name}:workers"
+
+    @property
+    def retries_key(self):
+        return f"{self.name}:retries"
+
+    @property
+    def dead_key(self):
+        return f"{self.name}:dead"
+
+    def processing_key(self, worker):
+        return f"{self.name}:processing:{worker}"
+
+    def heartbeat_key(self, worker):
+        return f"{self.name}:heartbeat:{worker}"
+
+    def push(self, payload):
+        get_redis().lpush(self.name, payload)
+
+    def start(self):
+        client = get_redis()
+        client.set(self.heartbeat_key(self.worker), 1, ex=settings.JOB_WORKER_TIMEOUT)
+        client.sadd(self.workers_key, self.worker)
+        if self.heartbeat is None:
+            self.heartbeat = threading.Thread(target=self.send_heartbeats, daemon=True)
+            self.heartbeat.start()
+        for worker in client.smembers(self.workers_key):
+            worker = worker.decode()
+            if worker != self.worker and not client.exists(self.heartbeat_key(worker)):
+                self.requeue(worker)
+
+    # Gives back whatever an interrupted run left unfinished
+    def stop(self):
+        get_redis().delete(self.heartbeat_key(self.worker))
+        self.requeue(self.worker)
+
+    def send_heartbeats(self):
+        while True:
+            time.sleep(settings.JOB_WORKER_TIMEOUT / 3)
+            try:
+                get_redis().set(self.heartbeat_key(self.worker), 1, ex=settings.JOB_WORKER_TIMEOUT)
+            except Exception:
+                logger.exception("Job worker heartbeat failed")
+
+    def requeue(self, worker):
+        client = get_redis()
+        # Back to the end the queue is popped from, oldest ends up first
+        while client.lmove(self.processing_key(worker), self.name, "LEFT", "RIGHT"):
+            pass
+        client.srem(self.workers_key, worker)
+
+    def pop(self, timeout):
+        client = get_redis()
+        next_due = client.eval(PROMOTE_RETRIES, 2, self.retries_key, self.name, time.time())
+        if next_due is not None:
+            timeout = max(0.01, min(timeout, float(next_due) - time.time()))
+        return client.blmove(self.name, self.processing_key(self.worker), timeout, "RIGHT", "LEFT")
+
+    def scheduled(self):
+        return get_redis().zcard(self.retries_key)
+
+    def ack(self, payload):
+        get_redis().lrem(self.processing_key(self.worker), 1, payload)
+
+    def retry(self, payload, retry_payload, delay):
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.lrem(self.processing_key(self.worker), 1, payload)
+        pipe.zadd(self.retries_key, {retry_payload: time.time() + delay})
+        pipe.execute()
+
+    def bury(self, payload, dead_payload):
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.lrem(self.processing_key(self.worker), 1, payload)
+        pipe.lpush(self.dead_key, dead_payload)
+        pipe.execute()
+
+
+class InProcessBackend:
+    def __init__(self, name):
+        self.name = name
+        self.queue = queue.Queue()
+        self.retries = []
+        self.lock = threading.Lock()
+        self.dead = []
+
+    def push(self, payload):
+        self.queue.put(payload)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def pop(self, timeout):
+        with self.lock:
+            while self.retries and self.retries[0][0] <= time.time():
+                self.queue.put(heapq.heappop(self.retries)[1])
+            if self.retries:
+                timeout = max(0.01, min(timeout, self.retries[0][0] - time.time()))
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def scheduled(self):
+        return len(self.retries)
+
+    def ack(self, payload):
+        pass
+
+    def retry(self, payload, retry_payload, delay):
+        with self.lock:
+            heapq.heappush(self.retries, (time.time() + delay, retry_payload))
+
+    def bury(self, payload, dead_payload):
+        self.dead.append(dead_payload)
+
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = settings.JOB_QUEUE
+        _backend = import_string(config["BACKEND"])(config.get("NAME", "jobs"))
+    return _backend
+
+def enqueue(func, *args, **kwargs):
+    payload = json.dumps({
+        "func": f"{func.__module__}.{func.__name__}",
+        "args": args,
+        "kwargs": kwargs,
+    })
+    get_backend().push(payload)
+
+async def aenqueue(func, *args, **kwargs):
+    await sync_to_async(enqueue, thread_sensitive=False)(func, *args, **kwargs)
+
+def run_job(payload):
+    job = json.loads(payload)
+    func = import_string(job["func"])
+    close_old_connections()
+    try:
+        func(*job["args"], **job["kwargs"])
+    finally:
+        close_old_connections()
+
+def retry_delay(attempts):
+    delay = min(settings.JOB_RETRY_BACKOFF_MAX, settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+# A failed job runs again after an exponential backoff until it has used up
+# JOB_MAX_ATTEMPTS, then goes to the dead letter list to be looked at by hand
+def fail_job(backend, payload):
+    try:
+        job = json.loads(payload)
+    except ValueError:
+        backend.bury(payload, payload)
+        return
+    job["attempts"] = job.get("attempts", 0) + 1
+    # Keeps two identical jobs apart in the retry set
+    job.setdefault("id", uuid4().hex)
+    if job["attempts"] >= settings.JOB_MAX_ATTEMPTS:
+        logger.error("Giving up on %s after %s attempts", job["func"], job["attempts"])
+        backend.bury(payload, json.dumps(job))
+    else:
+        backend.retry(payload, json.dumps(job), retry_delay(job["attempts"]))
+
+def work(timeout=5, burst=False):
+    backend = get_backend()
+    backend.start()
+    try:
+        while True:
+            payload = backend.pop(timeout)
+            if payload is None:
+                if burst and not backend.scheduled():
+                    return
+                continue
+            try:
+                run_job(payload)
+            except Exception:
+                logger.exception("Job failed: %s", payload)
+                fail_job(backend, payload)
+            else:
+                backend.ack(payload)
+    finally:
+        backend.stop()
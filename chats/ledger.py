@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from .models import InboundEvent
+from .redis_client import get_redis
+
+# Providers redeliver whatever they think timed out. A per-process LRU and a
+# Redis SETNX drop most duplicates before the database, the unique ledger row
+# written in the same transaction as the work is what actually guarantees it.
+# Only ids whose ledger row committed go into the LRU: a claim can be released
+# by another process (the webhook claims, a worker fails), which can't reach
+# this process' LRU.
+
+_recent = OrderedDict()
+
+
+def event_key(provider, event_id):
+    return f"inbound:{provider}:{event_id}"
+
+def remember(keys):
+    for key in keys:
+        _recent[key] = True
+        _recent.move_to_end(key)
+    while len(_recent) > settings.INBOUND_EVENT_CACHE_SIZE:
+        _recent.popitem(last=False)
+
+def claim_events(provider, event_ids):
+    event_ids = [event_id for event_id in dict.fromkeys(event_ids) if event_key(provider, event_id) not in _recent]
+    if not event_ids:
+        return []
+    try:
+        pipe = get_redis().pipeline()
+        for event_id in event_ids:
+            pipe.set(event_key(provider, event_id), 1, nx=True, ex=settings.INBOUND_EVENT_TIMEOUT)
+        return [event_id for event_id, fresh in zip(event_ids, pipe.execute()) if fresh]
+    except redis.RedisError as e:
+        # Without Redis the ledger alone decides
+        print(e)
+        return event_ids
+
+# Gives events back when handling them failed, so the provider's retry goes through
+def release_events(provider, event_ids):
+    keys = [event_key(provider, event_id) for event_id in event_ids]
+    for key in keys:
+        _recent.pop(key, None)
+    try:
+        if keys:
+            get_redis().delete(*keys)
+    except redis.RedisError as e:
+        print(e)
+
+# Must run inside the transaction doing the work: a concurrent duplicate fails
+# on the unique constraint and rolls back with it
+def record_events(provider, event_ids):
+    event_ids = list(dict.fromkeys(event_ids))
+    seen = set(InboundEvent.objects.filter(provider=provider, event_id__in=event_ids).values_list("event_id", flat=True))
+    fresh = [event_id for event_id in event_ids if event_id not in seen]
+    InboundEvent.objects.bulk_create([InboundEvent(provider=provider, event_id=event_id) for event_id in fresh])
+    transaction.on_commit(lambda: remember([event_key(provider, event_id) for event_id in event_ids]))
+    return fresh
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 
 from .models import Profile
+from .presence import get_online_user_ids
 
 User = get_user_model()
 
@@ -42,33 +43,39 @@ def send_message_notification(message):
     }
     sender = message.from_user
     assignee = message.conversation.assigned_to
-    admins = Profile.objects.filter(admin=True)
+    admins = Profile.objects.filter(admin=True).select_related('user')
+    # Nobody needs an email for a chat they are looking at
+    online = get_online_user_ids(message.conversation.name)
 
     if not assignee:
-        recipients = [admin.user.email for admin in admins]
+        recipients = [admin.user.email for admin in admins if admin.user_id not in online]
         template = 'message_notification_no_assignee.html'
     elif sender == assignee:
-        recipients = [message.conversation.user.email]
+        customer = message.conversation.user
+        recipients = [customer.email] if customer and customer.id not in online else []
     else:
-        recipients = [assignee.email]
+        recipients = [assignee.email] if assignee.id not in online else []
 
-    EmailThread(subject, template, recipients, context).start()
+    if recipients:
+        EmailThread(subject, template, recipients, context).start()
 
 def send_document_upload_notification(document):
+    send_documents_upload_notification(document.conversation, [document])
+
+def send_documents_upload_notification(conversation, documents):
     subject = 'Nuevo documento recibido'
     template = 'document_upload_notification.html'
 
     context = {
-        'user': document.conversation.user,
+        'user': conversation.user,
         'domain': settings.SITE_DOMAIN,
-        'document': document,
+        'documents': documents,
     }
 
-    recipients = [document.conversation.user.email]
-    if document.conversation.assigned_to:
-        recipients.append(document.conversation.assigned_to.email)
-
-    EmailThread(subject, template, recipients, context).start()
+    # Anonymous web conversations have no customer to tell, only the assignee
+    recipients = [user.email for user in (conversation.user, conversation.assigned_to) if user and user.email]
+    if recipients:
+        EmailThread(subject, template, recipients, context).start()
 
 def send_document_requested_notification(document):
     subject = 'Documento solicitado'
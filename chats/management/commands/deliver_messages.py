@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chats.delivery import work_deliveries
+
+
+class Command(BaseCommand):
+    help = "Send queued WhatsApp and Telegram replies, within the provider rate limits"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.DELIVERY_WORKERS, help="Messages sent at the same time")
+        parser.add_argument("--poll", type=float, default=1, help="Seconds to wait when nothing is due")
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        work_deliveries(workers=options["workers"], poll=options["poll"], burst=options["burst"])
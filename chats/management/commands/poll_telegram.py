@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chats.inbound import poll_telegram
+
+
+class Command(BaseCommand):
+    help = "Pull Telegram updates with getUpdates long polling, for when the webhook is not set"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--timeout", type=int, default=settings.TELEGRAM_POLL_TIMEOUT, help="Seconds each getUpdates call waits for updates")
+        parser.add_argument("--limit", type=int, default=100, help="Updates fetched per call, at most 100")
+        parser.add_argument("--once", action="store_true", help="Exit after a single getUpdates call")
+
+    def handle(self, *args, **options):
+        poll_telegram(timeout=options["timeout"], limit=min(options["limit"], 100), once=options["once"])
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.models import InboundEvent
+
+
+class Command(BaseCommand):
+    help = "Delete inbound event ledger rows older than INBOUND_EVENT_RETENTION days"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.INBOUND_EVENT_RETENTION, help="Keep this many days of events")
+
+    def handle(self, *args, **options):
+        deleted, _ = InboundEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=options["days"])).delete()
+        self.stdout.write(f"Deleted {deleted} inbound events")
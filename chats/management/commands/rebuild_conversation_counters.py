@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from chats.counters import rebuild_conversation_counters
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "Recompute last message and unread counters of conversations from their messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversation", type=int, action="append", help="Only rebuild this conversation id, can be repeated")
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.all()
+        if options["conversation"]:
+            conversations = conversations.filter(id__in=options["conversation"])
+        updated = rebuild_conversation_counters(conversations)
+        self.stdout.write(f"Rebuilt {updated} conversations")
@@ -0,0 +1,75 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        stub = self.server.stub
+        if self.path.endswith("/getUpdates"):
+            return self.reply(200, {"ok": True, "result": []})
+        if not (self.path.endswith("/messages") or self.path.endswith("/sendMessage")):
+            return self.reply(404, {"error": "Not found"})
+        time.sleep(stub["latency"])
+        with stub["lock"]:
+            now = time.monotonic()
+            stub["tokens"] = min(stub["rate"], stub["tokens"] + (now - stub["ts"]) * stub["rate"])
+            stub["ts"] = now
+            limited = stub["tokens"] < 1
+            if not limited:
+                stub["tokens"] -= 1
+            failed = not limited and random.random() < stub["error_rate"]
+            stub["counts"]["429" if limited else "503" if failed else "200"] += 1
+        if limited:
+            return self.reply(429, {"error": "Too many requests"}, [("Retry-After", "1")])
+        if failed:
+            return self.reply(503, {"error": "Unavailable"})
+        recipient = body.get("to") or body.get("chat_id")
+        self.reply(200, {"ok": True, "messages": [{"id": f"stub.{recipient}.{time.time()}"}]})
+
+
+class Command(BaseCommand):
+    help = "Serve stand-ins for the WhatsApp and Telegram send APIs, for load testing deliver_messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--rate", type=float, default=80, help="Sends per second accepted before answering 429")
+        parser.add_argument("--error-rate", type=float, default=0, help="Fraction of sends answered with 503")
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds each send takes")
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), StubHandler)
+        server.stub = {
+            "rate": options["rate"], "tokens": options["rate"], "ts": time.monotonic(),
+            "error_rate": options["error_rate"], "latency": options["latency"],
+            "lock": threading.Lock(), "counts": {"200": 0, "429": 0, "503": 0},
+        }
+        self.stdout.write(f"Set WHATSAPP_API_URL and TELEGRAM_API_URL to http://127.0.0.1:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(json.dumps(server.stub["counts"]))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chats.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Process background jobs such as autopilot replies"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--timeout", type=int, default=5, help="Seconds to block waiting for a job")
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        work(timeout=options["timeout"], burst=options["burst"])
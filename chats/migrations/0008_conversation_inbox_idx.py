@@ -0,0 +1,17 @@
+# Generated by Django 4.1.5 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_profile_anonymous'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['archived', '-updated_at', '-id'], name='conversation_inbox_idx'),
+        ),
+    ]
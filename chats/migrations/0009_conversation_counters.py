@@ -0,0 +1,64 @@
+# Generated by Django 4.1.5 on 2026-10-18 15:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# Frozen copy of chats.counters.rebuild_conversation_counters for the models
+# as they are here, read cursors only come in 0010
+
+
+def backfill_counters(apps, schema_editor):
+    Conversation = apps.get_model("chats", "Conversation")
+    Message = apps.get_model("chats", "Message")
+    Profile = apps.get_model("chats", "Profile")
+    anonymous_user_id = Profile.objects.filter(Anonymous=True).values_list("user_id", flat=True).first()
+
+    # Customer messages come from conversation.user, or from the anonymous user in web chats
+    own = Q(conversation__user__isnull=False, from_user=F("conversation__user"))
+    visitor = Q(conversation__user__isnull=True, from_user=anonymous_user_id)
+    customer = own | visitor
+
+    def unread(messages):
+        messages = messages.filter(conversation=OuterRef("pk"), read=False)
+        return Coalesce(Subquery(messages.order_by().values("conversation").annotate(total=Count("id")).values("total")), Value(0))
+
+    last = Message.objects.filter(conversation=OuterRef("pk")).order_by("-created_at", "-id")
+    Conversation.objects.update(
+        last_message=Subquery(last.values("id")[:1]),
+        last_message_at=Subquery(last.values("created_at")[:1]),
+        unread_by_admins=unread(Message.objects.filter(customer)),
+        unread_by_user=unread(Message.objects.exclude(customer)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_conversation_inbox_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='unread_by_admins',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='unread_by_user',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.1.5 on 2026-10-18 16:20
+
+from django.db import migrations
+
+# The DDL is frozen here, chats.search may change without rewriting history
+
+POSTGRES_INSTALL = [
+    """ALTER TABLE chats_message ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(message, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS message_search_idx ON chats_message USING GIN (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS message_search_idx",
+    "ALTER TABLE chats_message DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_insert AFTER INSERT ON chats_message BEGIN
+        INSERT INTO chats_message_fts(rowid, message) VALUES (new.id, coalesce(new.message, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_delete AFTER DELETE ON chats_message BEGIN
+        INSERT INTO chats_message_fts(chats_message_fts, rowid, message) VALUES ('delete', old.id, coalesce(old.message, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_update AFTER UPDATE OF message ON chats_message BEGIN
+        INSERT INTO chats_message_fts(chats_message_fts, rowid, message) VALUES ('delete', old.id, coalesce(old.message, ''));
+        INSERT INTO chats_message_fts(rowid, message) VALUES (new.id, coalesce(new.message, ''));
+    END""",
+]
+
+SQLITE_INSTALL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chats_message_fts USING fts5(
+        message, content='chats_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    *SQLITE_TRIGGERS,
+    "INSERT INTO chats_message_fts(chats_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS chats_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chats_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chats_message_fts_update",
+    "DROP TABLE IF EXISTS chats_message_fts",
+]
+
+
+def run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+def install(apps, schema_editor):
+    run(schema_editor, {"postgresql": POSTGRES_INSTALL, "sqlite": SQLITE_INSTALL})
+
+def uninstall(apps, schema_editor):
+    run(schema_editor, {"postgresql": POSTGRES_UNINSTALL, "sqlite": SQLITE_UNINSTALL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0012_attachment_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
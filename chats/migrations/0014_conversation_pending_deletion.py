@@ -0,0 +1,18 @@
+# Generated by Django 4.1.5 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0013_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pending_deletion',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.5 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0014_conversation_pending_deletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboundEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('event_id', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='inboundevent',
+            index=models.Index(fields=['created_at'], name='inbound_event_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inboundevent',
+            constraint=models.UniqueConstraint(fields=('provider', 'event_id'), name='unique_inbound_event'),
+        ),
+    ]
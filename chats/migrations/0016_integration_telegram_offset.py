@@ -0,0 +1,18 @@
+# Generated by Django 4.1.5 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0015_inboundevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='integration',
+            name='telegram_offset',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
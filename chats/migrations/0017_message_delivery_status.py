@@ -0,0 +1,55 @@
+# Generated by Django 4.1.5 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+# SQLite adds and removes these columns by rebuilding chats_message, which
+# drops the search triggers from 0013 with the old table. The rows keep their
+# ids so the index stays valid, only the triggers are put back.
+
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_insert AFTER INSERT ON chats_message BEGIN
+        INSERT INTO chats_message_fts(rowid, message) VALUES (new.id, coalesce(new.message, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_delete AFTER DELETE ON chats_message BEGIN
+        INSERT INTO chats_message_fts(chats_message_fts, rowid, message) VALUES ('delete', old.id, coalesce(old.message, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_update AFTER UPDATE OF message ON chats_message BEGIN
+        INSERT INTO chats_message_fts(chats_message_fts, rowid, message) VALUES ('delete', old.id, coalesce(old.message, ''));
+        INSERT INTO chats_message_fts(rowid, message) VALUES (new.id, coalesce(new.message, ''));
+    END""",
+]
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in SQLITE_TRIGGERS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0016_integration_telegram_offset'),
+    ]
+
+    operations = [
+        # Runs last when unapplying, after the columns are removed
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_triggers),
+        migrations.AddField(
+            model_name='message',
+            name='delivery_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='delivery_error',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='delivery_status',
+            field=models.CharField(blank=True, choices=[('queued', 'En cola'), ('sent', 'Enviado'), ('failed', 'Fallido')], max_length=10, null=True),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+    ]
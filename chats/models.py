@@ -12,6 +12,12 @@ STATUS_CHOICES = (
     ('resolved', 'Resuelto')
 )
 
+DELIVERY_STATUS_CHOICES = (
+    ('queued', 'En cola'),
+    ('sent', 'Enviado'),
+    ('failed', 'Fallido'),
+)
+
 CHANNEL_CHOICES = (
     ('integrated', 'Integrado'),
     ('whatsapp', 'WhatsApp'),
@@ -24,6 +30,8 @@ class Integration(models.Model):
     telegram_token = models.CharField(max_length=255, blank=True, null=True)
     whatsapp_token = models.CharField(max_length=255, blank=True, null=True)
     web_token = models.CharField(max_length=255, blank=True, null=True)
+    # Next getUpdates offset for poll_telegram
+    telegram_offset = models.BigIntegerField(default=0)
 
     def __str__(self):
         return self.channel
@@ -38,14 +46,22 @@ class Conversation(models.Model):
     archived = models.BooleanField(default=False)
     autopilot = models.BooleanField(default=True)
     score = models.FloatField(default=1.0, blank=True, null=True)
+    pending_deletion = models.BooleanField(default=False)
+    # Maintained by chats.counters as messages are created and read
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    last_message_at = models.DateTimeField(blank=True, null=True)
+    unread_by_user = models.PositiveIntegerField(default=0)
+    unread_by_admins = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['archived', '-updated_at', '-id'], name='conversation_inbox_idx'),
+        ]
+
     def __str__(self):
         return self.name
-
-    def last_message(self):
-        return self.messages.last()
     
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages")
@@ -53,7 +69,16 @@ class Message(models.Model):
     message = models.TextField(blank=True, null=True)
     image = models.ImageField(blank=True, null=True)
     read = models.BooleanField(default=False)
+    # Only set on replies sent out through WhatsApp or Telegram, see chats.delivery
+    delivery_status = models.CharField(max_length=10, choices=DELIVERY_STATUS_CHOICES, blank=True, null=True)
+    delivery_attempts = models.PositiveSmallIntegerField(default=0)
+    delivery_error = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', '-created_at', '-id'], name='message_conversation_idx'),
+        ]
     
     def __str__(self):
         return f"{self.from_user.email} - {self.created_at}"
@@ -67,6 +92,11 @@ class Document(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='document_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.conversation}: {self.name}"
 
@@ -80,6 +110,11 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='payment_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.conversation}: {self.amount_cents}"
     
@@ -105,6 +140,36 @@ class Profile(models.Model):
             return "My balls"
         return self.user.email
 
+class ReadCursor(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="read_cursors")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_cursors")
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='unique_read_cursor'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.conversation}: {self.last_read_message_id}"
+
+class InboundEvent(models.Model):
+    provider = models.CharField(max_length=20)
+    event_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_inbound_event'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='inbound_event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}: {self.event_id}"
+
 def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
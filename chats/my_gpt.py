@@ -1,6 +1,10 @@
+import json
+
 import requests
 from django.conf import settings
 
+from . import http_client
+
 
 def get_my_ai_response(past_messages):
     url = settings.MY_GPT_URL
@@ -8,8 +12,31 @@ def get_my_ai_response(past_messages):
         "Content-Type": "application/json",
     }
     try:
-        r = requests.post(url, json=past_messages, headers=headers)
+        r = http_client.post(url, json=past_messages, headers=headers, timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.MY_GPT_TIMEOUT))
         return r.json()
     except requests.exceptions.HTTPError as err:
         return "Error"
-        
\ No newline at end of file
+
+def stream_my_ai_response(past_messages):
+    url = settings.MY_GPT_STREAM_URL
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    # The read timeout applies between chunks, not to the whole reply
+    with http_client.post(url, json=past_messages, headers=headers, stream=True, timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.MY_GPT_TIMEOUT)) as r:
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                chunk = data
+            if isinstance(chunk, dict):
+                chunk = chunk.get("delta") or chunk.get("text") or ""
+            if chunk:
+                yield chunk
@@ -1,6 +1,93 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class MessagePagination(PageNumberPagination):
+
+# Keyset pagination over (created_at, id), newest first. ?before=<id> pages
+# back into history and ?after=<id> forward towards the newest row, so pages
+# neither need a COUNT nor shift when rows are inserted.
+class KeysetPagination(BasePagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_cursor(self, queryset, param):
+        try:
+            row_id = int(self.request.query_params[param])
+        except (KeyError, ValueError):
+            return None
+        created_at = queryset.model.objects.filter(id=row_id).values_list('created_at', flat=True).first()
+        if created_at is None:
+            return None
+        return created_at, row_id
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        before = self.get_cursor(queryset, 'before')
+        after = None if before else self.get_cursor(queryset, 'after')
+
+        if after:
+            created_at, row_id = after
+            queryset = queryset.filter(created_at__gte=created_at).exclude(created_at=created_at, id__lte=row_id)
+            page = list(queryset.order_by('created_at', 'id')[:page_size + 1])
+            self.has_newer = len(page) > page_size
+            self.has_older = True
+            page = page[:page_size][::-1]
+        else:
+            if before:
+                created_at, row_id = before
+                # A range on created_at plus an exclude keeps this an index seek, an OR of the
+                # two conditions makes the database walk the conversation from the top
+                queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=row_id)
+            page = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+            self.has_older = len(page) > page_size
+            self.has_newer = before is not None
+            page = page[:page_size]
+
+        self.page = page
+        return page
+
+    def get_item_id(self, item):
+        return getattr(item, 'pk', item)
+
+    def get_next_link(self):
+        if not self.page or not self.has_older:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'after')
+        return replace_query_param(url, 'before', self.get_item_id(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.page or not self.has_newer:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'before')
+        return replace_query_param(url, 'after', self.get_item_id(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class MessagePagination(KeysetPagination):
     page_size = 50
+
+
+class AttachmentPagination(KeysetPagination):
+    page_size = 25
+
+
+class ConversationPagination(CursorPagination):
+    page_size = 30
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+    ordering = ('-updated_at', '-id')
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+
+from .models import Message
+from .serializers import MessageSerializer
+
+
+def get_payload_cache():
+    return caches[settings.MESSAGE_PAYLOAD_CACHE]
+
+def payload_key(message_id):
+    return f"message-payload:{message_id}"
+
+def payload_queryset():
+    return Message.objects.select_related("from_user__profile", "document", "payment")
+
+def render_message(message):
+    payload = MessageSerializer(message).data
+    document = getattr(message, "document", None)
+    if payload["document"] and document.file:
+        # Signed storage urls expire, keep the blob name and sign on read
+        payload["document"]["file"] = document.file.name
+    return payload
+
+def sign_payload(payload):
+    if payload["document"] and payload["document"]["file"]:
+        payload["document"]["file"] = default_storage.url(payload["document"]["file"])
+    return payload
+
+def get_message_payloads(message_ids):
+    message_ids = list(message_ids)
+    if not message_ids:
+        return []
+    payload_cache = get_payload_cache()
+    cached = payload_cache.get_many([payload_key(message_id) for message_id in message_ids])
+    payloads = {message_id: cached.get(payload_key(message_id)) for message_id in message_ids}
+
+    missing = [message_id for message_id, payload in payloads.items() if payload is None]
+    if missing:
+        rendered = {message.id: render_message(message) for message in payload_queryset().filter(id__in=missing)}
+        payload_cache.set_many({payload_key(message_id): payload for message_id, payload in rendered.items()})
+        payloads.update(rendered)
+
+    return [sign_payload(payloads[message_id]) for message_id in message_ids if payloads[message_id] is not None]
+
+def get_message_payload(message_id):
+    payloads = get_message_payloads([message_id])
+    if payloads:
+        return payloads[0]
+    return None
+
+def invalidate_message_payloads(message_ids):
+    message_ids = [message_id for message_id in message_ids if message_id]
+    if message_ids:
+        get_payload_cache().delete_many([payload_key(message_id) for message_id in message_ids])
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import redis
+from django.conf import settings
+
+from .events import apublish
+from .redis_client import get_redis, get_async_redis
+
+
+def presence_key(conversation_name):
+    return f"presence:{conversation_name}"
+
+def online_user_ids(members):
+    return {int(member.decode().split(":", 1)[0]) for member in members}
+
+def get_online_user_ids(conversation_name):
+    try:
+        members = get_redis().zrangebyscore(presence_key(conversation_name), time.time(), "+inf")
+    except redis.RedisError as e:
+        print(e)
+        return set()
+    return online_user_ids(members)
+
+async def aget_online_user_ids(conversation_name):
+    members = await get_async_redis().zrangebyscore(presence_key(conversation_name), time.time(), "+inf")
+    return online_user_ids(members)
+
+async def amark_present(conversation_name, member):
+    key = presence_key(conversation_name)
+    now = time.time()
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.zremrangebyscore(key, "-inf", now)
+        pipe.zadd(key, {member: now + settings.PRESENCE_TIMEOUT})
+        pipe.expire(key, settings.PRESENCE_TIMEOUT)
+        await pipe.execute()
+
+async def amark_absent(conversation_name, member):
+    await get_async_redis().zrem(presence_key(conversation_name), member)
+
+
+# Every socket is a member "<user id>:<channel name>" of the conversations it has open,
+# scored with the time it expires unless a heartbeat refreshes it
+class PresenceMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.present_in = set()
+        self.heartbeat = None
+
+    @property
+    def presence_member(self):
+        return f"{self.scope['user'].id}:{self.channel_name}"
+
+    async def enter_conversation(self, conversation_name):
+        try:
+            was_online = self.scope["user"].id in await aget_online_user_ids(conversation_name)
+            await amark_present(conversation_name, self.presence_member)
+        except redis.RedisError as e:
+            print(e)
+            return
+        self.present_in.add(conversation_name)
+        if self.heartbeat is None:
+            self.heartbeat = asyncio.create_task(self.send_heartbeats())
+        if not was_online:
+            await self.publish_presence(conversation_name, True)
+
+    async def leave_conversation(self, conversation_name):
+        if conversation_name not in self.present_in:
+            return
+        self.present_in.discard(conversation_name)
+        try:
+            await amark_absent(conversation_name, self.presence_member)
+            still_online = self.scope["user"].id in await aget_online_user_ids(conversation_name)
+        except redis.RedisError as e:
+            print(e)
+            return
+        if not still_online:
+            await self.publish_presence(conversation_name, False)
+
+    async def leave_all_conversations(self):
+        if self.heartbeat:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+        for conversation_name in list(self.present_in):
+            await self.leave_conversation(conversation_name)
+
+    async def send_heartbeats(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT)
+            for conversation_name in list(self.present_in):
+                try:
+                    await amark_present(conversation_name, self.presence_member)
+                except redis.RedisError as e:
+                    print(e)
+
+    async def publish_presence(self, conversation_name, online):
+        await apublish(conversation_name, {
+            "type": "presence",
+            "user": self.scope["user"].id,
+            "sender": self.scope["user"].email,
+            "online": online,
+        })
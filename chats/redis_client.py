@@ -0,0 +1,32 @@
+import asyncio
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.core.signals import setting_changed
+
+_client = None
+_async_clients = {}
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+def get_async_redis():
+    # asyncio connections are bound to the loop that opened them
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+    return client
+
+# Tests point REDIS_URL at their own database
+def reset_clients(setting, **kwargs):
+    global _client
+    if setting == "REDIS_URL":
+        _client = None
+        _async_clients.clear()
+
+setting_changed.connect(reset_clients)
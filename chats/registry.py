@@ -0,0 +1,66 @@
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .models import Integration
+
+User = get_user_model()
+
+_entries = {}
+
+def _peek(key):
+    entry = _entries.get(key)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+def _resolve(key, loader):
+    value = _peek(key)
+    if value is None:
+        value = loader()
+        _entries[key] = (value, time.monotonic() + settings.REGISTRY_TIMEOUT)
+    return value
+
+async def _aresolve(key, loader):
+    value = _peek(key)
+    if value is None:
+        value = await database_sync_to_async(_resolve)(key, loader)
+    return value
+
+def clear_registry():
+    _entries.clear()
+
+def _ai_user():
+    return User.objects.select_related("profile").get(profile__AI=True)
+
+def _anonymous_user():
+    return User.objects.select_related("profile").get(profile__Anonymous=True)
+
+def _integration(channel, web_token=None, create=False):
+    def loader():
+        if create:
+            return Integration.objects.get_or_create(channel=channel)[0]
+        if web_token:
+            return Integration.objects.get(channel=channel, web_token=web_token)
+        return Integration.objects.get(channel=channel)
+    return loader
+
+def get_ai_user():
+    return _resolve("ai-user", _ai_user)
+
+def get_anonymous_user():
+    return _resolve("anonymous-user", _anonymous_user)
+
+def get_integration(channel, web_token=None, create=False):
+    return _resolve(("integration", channel, web_token), _integration(channel, web_token, create))
+
+async def aget_ai_user():
+    return await _aresolve("ai-user", _ai_user)
+
+async def aget_anonymous_user():
+    return await _aresolve("anonymous-user", _anonymous_user)
+
+async def aget_integration(channel, web_token=None, create=False):
+    return await _aresolve(("integration", channel, web_token), _integration(channel, web_token, create))
@@ -0,0 +1,128 @@
+import re
+from html import escape
+
+from django.conf import settings
+from django.db import connection
+
+# Message text is indexed outside the ORM: a generated tsvector column with a
+# GIN index on Postgres, an external content FTS5 table kept in sync by
+# triggers on SQLite. Both are maintained by the database on every write.
+
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_insert AFTER INSERT ON chats_message BEGIN
+        INSERT INTO chats_message_fts(rowid, message) VALUES (new.id, coalesce(new.message, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_delete AFTER DELETE ON chats_message BEGIN
+        INSERT INTO chats_message_fts(chats_message_fts, rowid, message) VALUES ('delete', old.id, coalesce(old.message, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_message_fts_update AFTER UPDATE OF message ON chats_message BEGIN
+        INSERT INTO chats_message_fts(chats_message_fts, rowid, message) VALUES ('delete', old.id, coalesce(old.message, ''));
+        INSERT INTO chats_message_fts(rowid, message) VALUES (new.id, coalesce(new.message, ''));
+    END""",
+]
+
+
+# The index is created by migration 0013, and SQLite migrations that rebuild
+# chats_message put the triggers back themselves (see 0017). This only
+# repairs a rebuild that forgot to, and rebuilds the index it left stale.
+def ensure_search_index(sender, using="default", **kwargs):
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+
+    schema_connection = connections[using]
+    if schema_connection.vendor != "sqlite":
+        return
+    if not MigrationRecorder(schema_connection).migration_qs.filter(app="chats", name="0013_message_search").exists():
+        return
+    tables = schema_connection.introspection.table_names()
+    if "chats_message" not in tables or "chats_message_fts" not in tables:
+        return
+    with schema_connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", ["chats_message_fts_%"])
+        if cursor.fetchone()[0] == len(SQLITE_TRIGGERS):
+            return
+    with schema_connection.schema_editor() as schema_editor:
+        for statement in SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+        schema_editor.execute("INSERT INTO chats_message_fts(chats_message_fts) VALUES ('rebuild')")
+
+def fts5_query(query):
+    # Quote every term so user input can't use FTS5 operators, terms are ANDed
+    terms = re.findall(r"\w+", query)
+    return " ".join(f'"{term}"*' if index == len(terms) - 1 else f'"{term}"' for index, term in enumerate(terms))
+
+def filter_clauses(conversation=None, channel=None, created_after=None, created_before=None):
+    adapt = connection.ops.adapt_datetimefield_value
+    clauses, params = [], []
+    if conversation is not None:
+        clauses.append("m.conversation_id = %s")
+        params.append(conversation)
+    if channel:
+        clauses.append("i.channel = %s")
+        params.append(channel)
+    if created_after:
+        clauses.append("m.created_at >= %s")
+        params.append(adapt(created_after))
+    if created_before:
+        clauses.append("m.created_at < %s")
+        params.append(adapt(created_before))
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+def postgres_search(query, filters, params, limit, offset):
+    config = settings.SEARCH_CONFIG
+    sql = f"""
+        SELECT hit.id, hit.rank, ts_headline('{config}', hit.message, hit.query, %s)
+        FROM (
+            SELECT m.id, m.message, q.query, ts_rank(m.search_vector, q.query) AS rank
+            FROM chats_message m
+            JOIN chats_conversation c ON c.id = m.conversation_id
+            JOIN chats_integration i ON i.id = c.integration_id,
+            websearch_to_tsquery('{config}', %s) AS q(query)
+            WHERE m.search_vector @@ q.query{filters}
+            ORDER BY rank DESC, m.id DESC
+            LIMIT %s OFFSET %s
+        ) hit
+        ORDER BY hit.rank DESC, hit.id DESC
+    """
+    options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=20, MinWords=5"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [options, query, *params, limit, offset])
+        return cursor.fetchall()
+
+def sqlite_search(query, filters, params, limit, offset):
+    match = fts5_query(query)
+    if not match:
+        return []
+    # bm25() is lower for better matches, flip it so rank sorts the same way as on Postgres
+    sql = f"""
+        SELECT m.id, -bm25(chats_message_fts), snippet(chats_message_fts, 0, %s, %s, '…', 20)
+        FROM chats_message_fts
+        JOIN chats_message m ON m.id = chats_message_fts.rowid
+        JOIN chats_conversation c ON c.id = m.conversation_id
+        JOIN chats_integration i ON i.id = c.integration_id
+        WHERE chats_message_fts MATCH %s{filters}
+        ORDER BY bm25(chats_message_fts), m.id DESC
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [HIGHLIGHT_START, HIGHLIGHT_STOP, match, *params, limit, offset])
+        return cursor.fetchall()
+
+def render_highlight(highlight):
+    return escape(highlight or "").replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+
+def search_messages(query, limit, offset=0, **filters):
+    filters, params = filter_clauses(**filters)
+    if connection.vendor == "postgresql":
+        rows = postgres_search(query, filters, params, limit, offset)
+    elif connection.vendor == "sqlite":
+        rows = sqlite_search(query, filters, params, limit, offset)
+    else:
+        rows = []
+    return [
+        {"id": message_id, "rank": float(rank), "highlight": render_highlight(highlight)}
+        for message_id, rank, highlight in rows
+    ]
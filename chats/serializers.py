@@ -72,12 +72,21 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'email', 'phone', 'first_name', 'last_name', 'profile')
 
-class DocumentSerializer(serializers.ModelSerializer):
+# Takes fields=[...] to only render a subset of the declared fields
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class DocumentSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Document
         fields = ('id', 'name', 'file', 'message', 'conversation', 'staging', 'created_at', 'updated_at')
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Payment
         fields = ('id', 'description', 'amount_cents', 'paid', 'created_at')
@@ -88,7 +97,7 @@ class MessageSerializer(serializers.ModelSerializer):
     payment = PaymentSerializer()
     class Meta:
         model = Message
-        fields = ('id', 'conversation', 'from_user', 'message', 'read', 'image', 'document', 'payment', 'created_at')
+        fields = ('id', 'conversation', 'from_user', 'message', 'read', 'image', 'document', 'payment', 'delivery_status', 'created_at')
 
 class IntegrationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -97,10 +106,26 @@ class IntegrationSerializer(serializers.ModelSerializer):
 
 class ConversationSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    last_message = MessageSerializer(read_only=True)
+    last_message = serializers.SerializerMethodField()
     integration = IntegrationSerializer(read_only=True)
     class Meta:
         model = Conversation
-        fields = ('id', 'integration', 'user', 'name', 'status', 'archived', 'autopilot' ,'created_at', 'updated_at', 'assigned_to', 'last_message')
-        read_only_fields = ('name',)
-
+        fields = ('id', 'integration', 'user', 'name', 'status', 'archived', 'autopilot' ,'created_at', 'updated_at', 'assigned_to', 'last_message', 'last_message_at', 'unread_by_user', 'unread_by_admins')
+        read_only_fields = ('name', 'last_message_at', 'unread_by_user', 'unread_by_admins')
+
+    # Counters are kept by chats.counters, a full save would write back stale values
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data) + ['updated_at'])
+        return instance
+
+    def get_last_message(self, obj):
+        from .payloads import get_message_payload
+
+        # List views render the page's payloads in one go
+        if 'last_messages' in self.context:
+            return self.context['last_messages'].get(obj.last_message_id)
+        if obj.last_message_id:
+            return get_message_payload(obj.last_message_id)
+        return None
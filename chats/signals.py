@@ -0,0 +1,58 @@
+from django.db.models.signals import post_save, post_delete, pre_save, post_migrate
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+
+from .models import Message, Document, Payment, Profile, Integration
+from .payloads import invalidate_message_payloads
+from .counters import record_new_messages, record_deleted_message
+from .registry import clear_registry
+from .search import ensure_search_index
+
+User = get_user_model()
+
+
+def invalidate_message(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_message_payloads([instance.id])
+
+def count_message(sender, instance, created=False, **kwargs):
+    if created:
+        record_new_messages([instance])
+
+def uncount_message(sender, instance, **kwargs):
+    record_deleted_message(instance)
+
+def track_document_message(sender, instance, **kwargs):
+    if instance.pk:
+        previous = Document.objects.filter(pk=instance.pk).values_list("message_id", flat=True).first()
+        if previous != instance.message_id:
+            invalidate_message_payloads([previous])
+
+def invalidate_attachment_message(sender, instance, **kwargs):
+    invalidate_message_payloads([instance.message_id])
+
+def invalidate_registry(sender, instance, **kwargs):
+    clear_registry()
+
+def invalidate_registry_profile(sender, instance, created=False, **kwargs):
+    # Every new user gets a profile, only system profiles matter here
+    if created and not (instance.AI or instance.Anonymous):
+        return
+    clear_registry()
+
+post_save.connect(invalidate_message, sender=Message)
+post_delete.connect(invalidate_message, sender=Message)
+post_save.connect(count_message, sender=Message)
+post_delete.connect(uncount_message, sender=Message)
+pre_save.connect(track_document_message, sender=Document)
+post_save.connect(invalidate_attachment_message, sender=Document)
+post_delete.connect(invalidate_attachment_message, sender=Document)
+post_save.connect(invalidate_attachment_message, sender=Payment)
+post_delete.connect(invalidate_attachment_message, sender=Payment)
+post_save.connect(invalidate_registry, sender=Integration)
+post_delete.connect(invalidate_registry, sender=Integration)
+post_save.connect(invalidate_registry_profile, sender=Profile)
+post_delete.connect(invalidate_registry, sender=Profile)
+post_delete.connect(invalidate_registry, sender=User)
+post_migrate.connect(ensure_search_index, sender=apps.get_app_config('chats'))
@@ -0,0 +1,77 @@
+from uuid import uuid4
+
+from django.conf import settings
+
+from .models import Conversation, Message
+from .events import publish, publish_messages
+from .payloads import get_message_payloads, get_message_payload
+from .registry import get_ai_user
+from .my_gpt import get_my_ai_response, stream_my_ai_response
+from .delivery import SENDERS, queue_delivery
+from .mail import send_conversation_autopilot_deactivated
+
+
+# Stores a message from the AI user, replies to WhatsApp and Telegram go out
+# through chats.delivery. When queueing fails the error reaches the caller and
+# the stored reply waits for recover_deliveries.
+def create_ai_message(conversation, channel, text, **extra):
+    ai_user = get_ai_user()
+    ai_message = Message.objects.create(
+                        conversation=conversation,
+                        from_user=ai_user,
+                        message=text,
+                        read=False,
+                        delivery_status='queued' if channel in SENDERS else None
+                    )
+    if ai_message.delivery_status:
+        queue_delivery(ai_message.id)
+    try:
+        publish_messages(conversation.name, str(ai_user), [get_message_payload(ai_message.id)], **extra)
+    except Exception as e:
+        print(e)
+    return ai_message
+
+def generate_autopilot_reply(conversation_id):
+    conversation = Conversation.objects.select_related('integration').get(id=conversation_id)
+    if not conversation.autopilot:
+        return
+    channel = conversation.integration.channel
+
+    past_messages = Message.objects.filter(conversation=conversation).order_by('-created_at').values_list('id', flat=True)[:settings.AI_CONTEXT_SIZE]
+    past_messages = get_message_payloads(past_messages[::-1])
+
+    stream_id = None
+    try:
+        if settings.MY_GPT_STREAM_URL:
+            stream_id = str(uuid4())
+            ai_response = stream_ai_response(conversation.name, stream_id, past_messages)
+        else:
+            ai_response = get_my_ai_response(past_messages)
+
+        extra = {'stream_id': stream_id} if stream_id else {}
+        create_ai_message(conversation, channel, ai_response, **extra)
+
+    except Exception:
+        conversation.autopilot = False
+        if channel == 'whatsapp':
+            try:
+                create_ai_message(conversation, channel, "Ay, me desactivaron el autopilot")
+            except Exception as e:
+                print(e)
+        # The reply can take a while, don't write back stale counters
+        conversation.save(update_fields=['autopilot', 'updated_at'])
+        send_conversation_autopilot_deactivated(conversation)
+
+def stream_ai_response(conversation_name, stream_id, past_messages):
+    chunks = []
+    for delta in stream_my_ai_response(past_messages):
+        chunks.append(delta)
+        try:
+            publish(conversation_name, {
+                'type': 'ai_message_delta',
+                'stream_id': stream_id,
+                'delta': delta,
+            })
+        except Exception as e:
+            print(e)
+    return "".join(chunks)
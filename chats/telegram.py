@@ -1,15 +1,27 @@
-import requests
 from django.conf import settings
 
+from . import http_client
+
 TELEGRAM_TOKEN = settings.TELEGRAM_TOKEN
+TELEGRAM_API_URL = settings.TELEGRAM_API_URL
 
 def send_telegram(chat_id, message):
-  url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+  url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
   json = {
     "chat_id": chat_id,
     "text": message,
   }
-  try:
-    r = requests.post(url, json=json)
-  except requests.exceptions.HTTPError as err:
-    print(err)
\ No newline at end of file
+  return http_client.post(url, json=json, status_retries=False)
+
+def get_updates(offset, timeout, limit=100):
+  url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/getUpdates"
+  json = {
+    "offset": offset,
+    "limit": limit,
+    "timeout": timeout,
+    "allowed_updates": ["message"],
+  }
+  # Telegram holds the request open for up to timeout seconds
+  r = http_client.post(url, json=json, timeout=(settings.HTTP_CONNECT_TIMEOUT, timeout + 10))
+  r.raise_for_status()
+  return r.json()["result"]
@@ -1,3 +1,634 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from uuid import uuid4
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from AutoServiceAI.routing import websocket_urlpatterns
+from .http_client import build_session
+from .delivery import QUEUE_KEY, deliver, delivery_loop, queue_delivery
+from .inbound import process_whatsapp_delivery
+from .jobs import RedisBackend, enqueue, work
+from .ledger import claim_events, event_key
+from .mail import send_message_notification
+from .models import Conversation, Document, Integration, Message
+from .presence import get_online_user_ids
+from .redis_client import get_redis
+from .registry import clear_registry
+from .tasks import generate_autopilot_reply
+from .throttling import ThrottledConsumerMixin
+from .tickets import issue_ticket
+
+User = get_user_model()
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+LOCAL_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "payloads": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "payloads"},
+}
+# Presence, throttling, tickets, the ledger and the queues still need Redis,
+# the tests get a database of their own and empty it before each test
+TEST_SETTINGS = {
+    "CHANNEL_LAYERS": IN_MEMORY_LAYERS,
+    "CACHES": LOCAL_CACHES,
+    "REDIS_URL": f"{settings.REDIS_URL}/15",
+    "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+}
+
+
+async def receive_event(communicator, event_type):
+    event = await communicator.receive_json_from(timeout=30)
+    while event["type"] != event_type:
+        event = await communicator.receive_json_from(timeout=30)
+    return event
+
+# Ids are reused between tests, cached payloads and registry entries are not
+def reset_state():
+    clear_registry()
+    for cache in caches.all():
+        cache.clear()
+    get_redis().flushdb()
+
+# Returns the history frame, the socket's own presence event always follows it
+async def connect_socket(communicator):
+    connected, _ = await communicator.connect(timeout=30)
+    assert connected
+    last_messages = await receive_event(communicator, "last_messages")
+    await receive_event(communicator, "presence")
+    return last_messages
+
+def create_anonymous_user():
+    user = User.objects.create(email="anonymous@autoservice.test")
+    user.profile.Anonymous = True
+    user.profile.save()
+    return user
+
+def create_admin_user():
+    user = User.objects.create(email="admin@autoservice.test")
+    user.profile.admin = True
+    user.profile.save()
+    return user
+
+def create_ai_user():
+    user = User.objects.create(email="ai@autoservice.test")
+    user.profile.AI = True
+    user.profile.save()
+    return user
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    DELTAS = ["Ho", "la", " mundo"]
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for delta in self.DELTAS:
+            self.wfile.write(f"data: {json.dumps({'delta': delta})}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(**TEST_SETTINGS)
+class ConsumerConcurrencyTests(TransactionTestCase):
+    IDLE_SOCKETS = 2000
+    CHATTY_SOCKETS = 50
+    MESSAGES_PER_SOCKET = 3
+
+    def setUp(self):
+        reset_state()
+        Integration.objects.create(channel="web", web_token="test-token")
+        create_anonymous_user()
+
+    async def open_socket(self, application):
+        communicator = WebsocketCommunicator(application, "/anonymous/?web_token=test-token")
+        await connect_socket(communicator)
+        return communicator
+
+    async def chat(self, communicator):
+        for i in range(self.MESSAGES_PER_SOCKET):
+            await communicator.send_json_to({"type": "chat_message", "message": f"hola {i}"})
+            event = await communicator.receive_json_from(timeout=30)
+            self.assertEqual(event["type"], "chat_message_echo")
+            self.assertEqual(event["message"]["message"], f"hola {i}")
+
+    async def run_sockets(self):
+        application = URLRouter(websocket_urlpatterns)
+        idle = await asyncio.gather(*[self.open_socket(application) for _ in range(self.IDLE_SOCKETS)])
+        chatty = await asyncio.gather(*[self.open_socket(application) for _ in range(self.CHATTY_SOCKETS)])
+
+        await asyncio.gather(*[self.chat(communicator) for communicator in chatty])
+
+        # Every socket has its own conversation, the idle ones must not see the chatter
+        for communicator in idle:
+            self.assertTrue(await communicator.receive_nothing(timeout=0.01))
+        for communicator in idle + chatty:
+            await communicator.disconnect()
+
+    def test_idle_and_chatty_sockets(self):
+        async_to_sync(self.run_sockets)()
+        self.assertEqual(Message.objects.count(), self.CHATTY_SOCKETS * self.MESSAGES_PER_SOCKET)
+
+
+@override_settings(**TEST_SETTINGS)
+class AutopilotStreamingTests(TestCase):
+    def setUp(self):
+        reset_state()
+        create_ai_user()
+        integration = Integration.objects.create(channel="web", web_token="test-token")
+        self.conversation = Conversation.objects.create(name="STREAMING", integration=integration)
+        Message.objects.create(conversation=self.conversation, from_user=create_anonymous_user(), message="hola")
+
+    async def subscribe(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(self.conversation.name, channel)
+        return channel
+
+    async def receive_events(self, channel, count):
+        layer = get_channel_layer()
+        return [await asyncio.wait_for(layer.receive(channel), 5) for _ in range(count)]
+
+    def test_deltas_are_published_before_the_message(self):
+        channel = async_to_sync(self.subscribe)()
+        with StubServer(StreamHandler) as server, override_settings(MY_GPT_STREAM_URL=server.url):
+            generate_autopilot_reply(self.conversation.id)
+
+        events = async_to_sync(self.receive_events)(channel, len(StreamHandler.DELTAS) + 1)
+        deltas, final = events[:-1], events[-1]
+        self.assertEqual([event["type"] for event in deltas], ["ai_message_delta"] * len(StreamHandler.DELTAS))
+        self.assertEqual([event["delta"] for event in deltas], StreamHandler.DELTAS)
+        self.assertEqual(final["type"], "chat_message_echo")
+        self.assertEqual(final["stream_id"], deltas[0]["stream_id"])
+        self.assertEqual(final["message"]["message"], "Hola mundo")
+
+        reply = Message.objects.filter(conversation=self.conversation, from_user__profile__AI=True).get()
+        self.assertEqual(reply.message, "Hola mundo")
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.autopilot)
+
+
+@override_settings(**TEST_SETTINGS)
+class AttachDocumentsTests(TransactionTestCase):
+    def setUp(self):
+        reset_state()
+        self.admin = create_admin_user()
+        integration = Integration.objects.create(channel="web", web_token="test-token")
+        self.agent = User.objects.create(email="agent@autoservice.test")
+        self.conversation = Conversation.objects.create(name="ANONYMOUS", integration=integration, assigned_to=self.agent)
+        self.document = Document.objects.create(name="factura.pdf", conversation=self.conversation, staging=True)
+
+    async def send_chat_message(self, documents):
+        application = URLRouter(websocket_urlpatterns)
+        communicator = WebsocketCommunicator(application, f"/ANONYMOUS/?ticket_uuid={self.ticket}")
+        await connect_socket(communicator)
+        await communicator.send_json_to({"type": "chat_message", "message": "adjunto", "documents": documents})
+        event = await communicator.receive_json_from(timeout=5)
+        await communicator.disconnect()
+        return event
+
+    def test_admin_attaches_document_in_anonymous_conversation(self):
+        self.ticket = issue_ticket(self.admin)
+        with patch("chats.mail.EmailThread") as email:
+            event = async_to_sync(self.send_chat_message)([str(self.document.id)])
+        self.assertEqual([call.args[0] for call in email.call_args_list], ["Nuevo mensaje recibido", "Nuevo documento recibido"])
+        self.assertEqual(event["type"], "chat_message_echo")
+        self.document.refresh_from_db()
+        self.assertFalse(self.document.staging)
+        self.assertIsNotNone(self.document.message_id)
+
+    def test_invalid_document_ids_are_rejected(self):
+        self.ticket = issue_ticket(self.admin)
+        event = async_to_sync(self.send_chat_message)(["1; DROP", None])
+        self.assertEqual(event, {"type": "invalid_frame", "frame": "chat_message", "error": "Invalid documents"})
+        self.assertFalse(Message.objects.exists())
+
+    def test_assignee_message_in_anonymous_conversation_notifies_nobody(self):
+        message = Message.objects.create(conversation=self.conversation, from_user=self.agent, message="hola")
+        with patch("chats.mail.EmailThread") as email:
+            send_message_notification(message)
+        email.assert_not_called()
+
+    def test_failed_attach_rolls_back_the_message(self):
+        self.ticket = issue_ticket(self.admin)
+        with patch("chats.consumers.record_new_messages", side_effect=RuntimeError("database down")), patch("chats.mail.EmailThread") as email:
+            with self.assertRaises(RuntimeError):
+                async_to_sync(self.send_chat_message)([str(self.document.id)])
+        self.assertFalse(Message.objects.exists())
+        self.document.refresh_from_db()
+        self.assertTrue(self.document.staging)
+        email.assert_not_called()
+
+
+class ThrottledConsumer(ThrottledConsumerMixin):
+    def __init__(self, user):
+        self.scope = {"user": user}
+        self.channel_name = f"test.{user.id}"
+
+
+@override_settings(**TEST_SETTINGS, WEBSOCKET_RATE_LIMITS={"ThrottledConsumer": {"conversation": {"chat_message": (0.001, 2)}}})
+class ConversationThrottleTests(TestCase):
+    def setUp(self):
+        reset_state()
+
+    def test_senders_have_their_own_conversation_bucket(self):
+        customer = ThrottledConsumer(create_anonymous_user())
+        agent = ThrottledConsumer(create_admin_user())
+        allow = async_to_sync(ThrottledConsumerMixin.allow_frame)
+
+        self.assertEqual([allow(customer, "THROTTLE", "chat_message") for _ in range(3)], [True, True, False])
+        self.assertTrue(allow(agent, "THROTTLE", "chat_message"))
+
+
+@override_settings(**TEST_SETTINGS)
+class AnonymousWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        reset_state()
+        self.admin = create_admin_user()
+        self.anonymous = create_anonymous_user()
+        Integration.objects.create(channel="web", web_token="test-token")
+
+    async def admin_types_to_visitor(self):
+        application = URLRouter(websocket_urlpatterns)
+        visitor = WebsocketCommunicator(application, "/anonymous/?web_token=test-token")
+        conversation_name = (await connect_socket(visitor))["conversation_name"]
+
+        admin = WebsocketCommunicator(application, f"/{conversation_name}/?ticket_uuid={await sync_to_async(issue_ticket)(self.admin)}")
+        self.assertTrue((await admin.connect())[0])
+        await admin.send_json_to({"type": "typing", "typing": True})
+
+        events = [await visitor.receive_json_from(timeout=5) for _ in range(2)]
+        self.assertEqual([event["type"] for event in events], ["presence", "typing_echo"])
+        self.assertEqual(events[1]["sender"], self.admin.email)
+        self.assertTrue(events[1]["typing"])
+        await admin.disconnect()
+        await visitor.disconnect()
+
+    def test_visitor_receives_admin_typing(self):
+        async_to_sync(self.admin_types_to_visitor)()
+
+    async def visitor_comes_and_goes(self):
+        application = URLRouter(websocket_urlpatterns)
+        visitor = WebsocketCommunicator(application, "/anonymous/?web_token=test-token")
+        conversation_name = (await connect_socket(visitor))["conversation_name"]
+
+        admin = WebsocketCommunicator(application, f"/{conversation_name}/?ticket_uuid={await sync_to_async(issue_ticket)(self.admin)}")
+        await connect_socket(admin)
+        self.assertEqual(await sync_to_async(get_online_user_ids)(conversation_name), {self.anonymous.id, self.admin.id})
+
+        await visitor.disconnect()
+        event = await receive_event(admin, "presence")
+        self.assertEqual((event["user"], event["online"]), (self.anonymous.id, False))
+        self.assertEqual(await sync_to_async(get_online_user_ids)(conversation_name), {self.admin.id})
+        await admin.disconnect()
+
+    def test_agents_see_visitor_presence(self):
+        async_to_sync(self.visitor_comes_and_goes)()
+
+
+@override_settings(**TEST_SETTINGS)
+class AdminInboxTests(TransactionTestCase):
+    def setUp(self):
+        reset_state()
+        self.admin = create_admin_user()
+        integration = Integration.objects.create(channel="web", web_token="test-token")
+        conversation = Conversation.objects.create(name="INBOX", integration=integration)
+        Message.objects.create(conversation=conversation, from_user=create_anonymous_user(), message="hola")
+
+    async def subscribe(self, frame):
+        application = URLRouter(websocket_urlpatterns)
+        inbox = WebsocketCommunicator(application, f"/inbox/?ticket_uuid={await sync_to_async(issue_ticket)(self.admin)}")
+        self.assertTrue((await inbox.connect())[0])
+        await inbox.send_json_to(frame)
+        event = await receive_event(inbox, "last_messages")
+        await inbox.disconnect()
+        return event
+
+    def test_subscribe_without_a_cursor(self):
+        for since in (None, "abc"):
+            event = async_to_sync(self.subscribe)({"type": "subscribe", "conversation": "INBOX", "since": since})
+            self.assertEqual([message["message"] for message in event["messages"]], ["hola"])
+
+
+@override_settings(**TEST_SETTINGS)
+class ConversationsViewQueryTests(TestCase):
+    CONVERSATIONS = 40
+    # The page of conversations, then all their last messages at once
+    QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin_user()
+        integration = Integration.objects.create(channel="whatsapp")
+        for i in range(cls.CONVERSATIONS):
+            user = User.objects.create(phone=f"5491100000{i:03}")
+            conversation = Conversation.objects.create(name=user.phone, integration=integration, user=user, assigned_to=cls.admin)
+            Message.objects.create(conversation=conversation, from_user=user, message=f"hola {i}")
+
+    def setUp(self):
+        reset_state()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assert_page_queries(self, page_size):
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get("/conversations/", {"page_size": page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), page_size)
+
+    def test_small_page(self):
+        self.assert_page_queries(5)
+
+    def test_full_page(self):
+        self.assert_page_queries(30)
+
+
+@override_settings(**TEST_SETTINGS)
+class ConversationDetailViewTests(TestCase):
+    def setUp(self):
+        reset_state()
+        self.admin = create_admin_user()
+        integration = Integration.objects.create(channel="whatsapp")
+        self.conversation = Conversation.objects.create(name="5491100000001", integration=integration)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_update_only_writes_changed_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(f"/conversations/{self.conversation.id}/", {"autopilot": False}, format="json")
+        self.assertEqual(response.status_code, 200)
+        update = next(query["sql"] for query in queries if query["sql"].startswith("UPDATE"))
+        self.assertIn('"autopilot"', update)
+        self.assertNotIn('"unread_by_admins"', update)
+        self.assertNotIn('"last_message_id"', update)
+        self.conversation.refresh_from_db()
+        self.assertFalse(self.conversation.autopilot)
+
+
+JOB_CALLS = []
+JOB_FAILURES = []
+
+def record_job(value):
+    JOB_CALLS.append(value)
+
+def failing_job():
+    JOB_FAILURES.append(time.monotonic())
+    raise ValueError("failed")
+
+
+@override_settings(**TEST_SETTINGS, JOB_MAX_ATTEMPTS=3, JOB_RETRY_BACKOFF=0.2)
+class RedisJobQueueTests(TestCase):
+    def setUp(self):
+        reset_state()
+        JOB_CALLS.clear()
+        JOB_FAILURES.clear()
+        self.backend = RedisBackend("test:jobs")
+
+    def work(self):
+        with patch("chats.jobs.get_backend", return_value=self.backend):
+            work(timeout=1, burst=True)
+
+    def test_failed_job_is_retried_then_dead_lettered(self):
+        with patch("chats.jobs.get_backend", return_value=self.backend):
+            enqueue(failing_job)
+            enqueue(record_job, "done")
+        with self.assertLogs("chats.jobs", "ERROR") as logs:
+            self.work()
+
+        self.assertEqual(JOB_CALLS, ["done"])
+        self.assertEqual(len([line for line in logs.output if "Job failed" in line]), 3)
+        # Half the backoff at least, 0.2s doubled for the second retry
+        first, second = [later - earlier for earlier, later in zip(JOB_FAILURES, JOB_FAILURES[1:])]
+        self.assertGreaterEqual(first, 0.1)
+        self.assertGreaterEqual(second, 0.2)
+        client = get_redis()
+        dead = [json.loads(payload) for payload in client.lrange(self.backend.dead_key, 0, -1)]
+        self.assertEqual([(job["func"], job["attempts"]) for job in dead], [("chats.tests.failing_job", 3)])
+        self.assertEqual(client.llen(self.backend.name), 0)
+        self.assertEqual(client.zcard(self.backend.retries_key), 0)
+        self.assertEqual(client.llen(self.backend.processing_key(self.backend.worker)), 0)
+
+    def test_jobs_of_a_dead_worker_are_requeued(self):
+        crashed = RedisBackend(self.backend.name)
+        crashed.push(json.dumps({"func": "chats.tests.record_job", "args": ["first"], "kwargs": {}}))
+        crashed.push(json.dumps({"func": "chats.tests.record_job", "args": ["second"], "kwargs": {}}))
+        get_redis().sadd(crashed.workers_key, crashed.worker)
+        # Popped but never acknowledged, and no heartbeat left behind
+        crashed.pop(1)
+        crashed.pop(1)
+
+        self.work()
+        self.assertEqual(JOB_CALLS, ["first", "second"])
+        self.assertFalse(get_redis().sismember(self.backend.workers_key, crashed.worker))
+
+
+@override_settings(**TEST_SETTINGS)
+class WhatsappDeliveryTests(TestCase):
+    def setUp(self):
+        reset_state()
+
+    def delivery(self, message_id):
+        message = {"id": message_id, "from": "5491100000001", "text": {"body": "hola"}}
+        return {"entry": [{"changes": [{"value": {"messages": [message]}}]}]}
+
+    def test_failed_ingest_releases_claims(self):
+        message_id = f"wamid.{uuid4()}"
+        self.assertEqual(claim_events("whatsapp", [message_id]), [message_id])
+        with patch("chats.inbound.ingest_messages", side_effect=RuntimeError("database down")):
+            with self.assertRaises(RuntimeError):
+                process_whatsapp_delivery(self.delivery(message_id))
+        self.assertEqual(claim_events("whatsapp", [message_id]), [message_id])
+
+    def test_only_stored_events_are_remembered(self):
+        message_id = f"wamid.{uuid4()}"
+        self.assertEqual(claim_events("whatsapp", [message_id]), [message_id])
+        # Released by the worker, in another process
+        get_redis().delete(event_key("whatsapp", message_id))
+        self.assertEqual(claim_events("whatsapp", [message_id]), [message_id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_whatsapp_delivery(self.delivery(message_id))
+        get_redis().delete(event_key("whatsapp", message_id))
+        self.assertEqual(claim_events("whatsapp", [message_id]), [])
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+    UPDATES = []
+    offsets = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.offsets.append(body["offset"])
+        result = [update for update in self.UPDATES if update["update_id"] >= body["offset"]][:body["limit"]]
+        response = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(**TEST_SETTINGS)
+class PollTelegramTests(TestCase):
+    def setUp(self):
+        reset_state()
+        TelegramHandler.offsets = []
+        TelegramHandler.UPDATES = [
+            {"update_id": 500 + i, "message": {"chat": {"id": 9000 + i % 2}, "text": f"hola {i}"}}
+            for i in range(3)
+        ]
+        self.enqueue = patch("chats.inbound.enqueue").start()
+        self.addCleanup(patch.stopall)
+
+    def poll(self):
+        with StubServer(TelegramHandler) as server, patch("chats.telegram.TELEGRAM_API_URL", server.url.rstrip("/")):
+            call_command("poll_telegram", "--once", "--timeout", "0")
+
+    def test_updates_are_stored_and_offset_saved(self):
+        self.poll()
+        self.assertEqual(TelegramHandler.offsets, [0])
+        self.assertEqual(Integration.objects.get(channel="telegram").telegram_offset, 503)
+        messages = Message.objects.order_by("id")
+        self.assertEqual([message.message for message in messages], ["hola 0", "hola 1", "hola 2"])
+        self.assertEqual([message.conversation.name for message in messages], ["9000", "9001", "9000"])
+        self.assertEqual(self.enqueue.call_count, 2)
+
+        self.poll()
+        self.assertEqual(TelegramHandler.offsets, [0, 503])
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_replayed_updates_are_dropped(self):
+        self.poll()
+        # A crash before the offset was saved makes Telegram send the batch again
+        Integration.objects.filter(channel="telegram").update(telegram_offset=0)
+        TelegramHandler.UPDATES.append({"update_id": 503, "message": {"chat": {"id": 9000}, "text": "hola 3"}})
+        self.poll()
+
+        self.assertEqual(TelegramHandler.offsets, [0, 0])
+        self.assertEqual(Integration.objects.get(channel="telegram").telegram_offset, 504)
+        self.assertEqual(list(Message.objects.order_by("id").values_list("message", flat=True)), ["hola 0", "hola 1", "hola 2", "hola 3"])
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    status = 200
+    requests = []
+
+    def respond(self):
+        self.requests.append(self.command)
+        if self.command == "POST":
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(self.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(HTTP_RETRIES=2, HTTP_BACKOFF_FACTOR=0)
+class HttpClientRetryTests(TestCase):
+    def send(self, method, status):
+        StatusHandler.status = status
+        StatusHandler.requests = []
+        with StubServer(StatusHandler) as server:
+            response = build_session().request(method, server.url, json={} if method == "POST" else None, timeout=5)
+        self.assertEqual(response.status_code, status)
+        return len(StatusHandler.requests)
+
+    def test_post_is_retried_only_when_turned_away(self):
+        self.assertEqual(self.send("POST", 429), 3)
+        self.assertEqual(self.send("POST", 503), 3)
+        self.assertEqual(self.send("POST", 502), 1)
+        self.assertEqual(self.send("POST", 504), 1)
+
+    def test_get_is_retried_on_gateway_errors(self):
+        self.assertEqual(self.send("GET", 502), 3)
+        self.assertEqual(self.send("GET", 504), 3)
+
+
+@override_settings(**TEST_SETTINGS, HTTP_RETRIES=2, HTTP_BACKOFF_FACTOR=0, DELIVERY_RATE_LIMITS={})
+class DeliveryTests(TestCase):
+    def setUp(self):
+        reset_state()
+        create_ai_user()
+        user = User.objects.create(phone="5491100000001")
+        integration = Integration.objects.create(channel="whatsapp")
+        self.conversation = Conversation.objects.create(name=user.phone, integration=integration, user=user)
+        Message.objects.create(conversation=self.conversation, from_user=user, message="hola")
+
+    def test_throttled_send_is_left_to_the_queue(self):
+        message = Message.objects.create(conversation=self.conversation, from_user=create_admin_user(), message="respuesta", delivery_status="queued")
+        StatusHandler.status = 429
+        StatusHandler.requests = []
+        with StubServer(StatusHandler) as server, patch("chats.whatsapp.WHATSAPP_API_URL", server.url.rstrip("/")), patch("chats.delivery.queue_delivery") as queue_delivery:
+            deliver(message.id)
+
+        self.assertEqual(StatusHandler.requests, ["POST"])
+        queue_delivery.assert_called_once()
+        message.refresh_from_db()
+        self.assertEqual((message.delivery_status, message.delivery_attempts), ("queued", 1))
+
+    def test_autopilot_deactivation_notice_is_queued(self):
+        with patch("chats.tasks.get_my_ai_response", side_effect=RuntimeError("down")), patch("chats.tasks.queue_delivery") as queue_delivery:
+            generate_autopilot_reply(self.conversation.id)
+
+        notice = Message.objects.get(conversation=self.conversation, from_user__profile__AI=True)
+        self.assertEqual((notice.message, notice.delivery_status), ("Ay, me desactivaron el autopilot", "queued"))
+        queue_delivery.assert_called_once_with(notice.id)
+        self.conversation.refresh_from_db()
+        self.assertFalse(self.conversation.autopilot)
+
+    def test_failed_delivery_goes_back_on_the_queue(self):
+        queue_delivery(1234)
+        # The loop closes connections between deliveries, the test's one must stay open
+        with patch("chats.delivery.close_old_connections"), patch("chats.delivery.backoff", return_value=0):
+            with patch("chats.delivery.deliver", side_effect=[RuntimeError("database down"), None]) as deliver_mock:
+                with self.assertLogs("chats.delivery", "ERROR"):
+                    delivery_loop(poll=0.01, burst=True)
+
+        self.assertEqual([args for args, kwargs in deliver_mock.call_args_list], [(1234,), (1234,)])
+        self.assertEqual(get_redis().zcard(QUEUE_KEY), 0)
@@ -0,0 +1,90 @@
+import time
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis, get_async_redis
+
+DROPPED_KEY = "throttle:dropped"
+
+# Refills `rate` tokens per second up to `burst`, takes one token per call
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return allowed
+"""
+
+
+def get_rate_limits(name):
+    return settings.WEBSOCKET_RATE_LIMITS.get(name, {})
+
+def consume(key, rate, burst):
+    try:
+        allowed = get_redis().eval(TOKEN_BUCKET, 1, f"throttle:{key}", rate, burst, time.time())
+    except redis.RedisError as e:
+        print(e)
+        return True
+    return bool(allowed)
+
+async def aconsume(key, rate, burst):
+    client = get_async_redis()
+    try:
+        allowed = await client.eval(TOKEN_BUCKET, 1, f"throttle:{key}", rate, burst, time.time())
+    except redis.RedisError as e:
+        print(e)
+        return True
+    return bool(allowed)
+
+async def arecord_dropped(name, frame_type):
+    try:
+        await get_async_redis().hincrby(DROPPED_KEY, f"{name}:{frame_type}", 1)
+    except redis.RedisError as e:
+        print(e)
+
+def get_dropped_counts():
+    counts = get_redis().hgetall(DROPPED_KEY)
+    return {key.decode(): int(value) for key, value in counts.items()}
+
+
+# Limits are looked up in settings.WEBSOCKET_RATE_LIMITS by consumer class name
+class ThrottledConsumerMixin:
+
+    # Each sender gets its own conversation bucket, a chatty customer can't
+    # use up the agent's replies
+    def get_throttle_sender(self):
+        user = self.scope.get("user")
+        if user and user.is_authenticated:
+            return f"user:{user.id}"
+        return "anonymous"
+
+    async def allow_frame(self, conversation_name, frame_type):
+        name = self.__class__.__name__
+        limits = get_rate_limits(name)
+        buckets = []
+        if frame_type in limits.get("connection", {}):
+            buckets.append((f"connection:{self.channel_name}:{frame_type}", limits["connection"][frame_type]))
+        if conversation_name and frame_type in limits.get("conversation", {}):
+            buckets.append((f"conversation:{conversation_name}:{self.get_throttle_sender()}:{frame_type}", limits["conversation"][frame_type]))
+
+        for key, (rate, burst) in buckets:
+            if not await aconsume(key, rate, burst):
+                await arecord_dropped(name, frame_type)
+                return False
+        return True
+
+    async def reject_frame(self, frame_type):
+        # Typing indicators are simply dropped, everything else is reported back
+        if frame_type != "typing":
+            await self.send_json({"type": "rate_limited", "frame": frame_type})
@@ -0,0 +1,27 @@
+import json
+from uuid import uuid4
+
+from django.conf import settings
+
+from .redis_client import get_redis, get_async_redis
+
+
+def ticket_key(ticket_uuid):
+    return f"ticket:{ticket_uuid}"
+
+def issue_ticket(user, **extra):
+    ticket_uuid = str(uuid4())
+    claims = {
+        "user_id": user.id,
+        "admin": user.profile.admin,
+        **extra,
+    }
+    get_redis().set(ticket_key(ticket_uuid), json.dumps(claims), ex=settings.WEBSOCKET_TICKET_TIMEOUT)
+    return ticket_uuid
+
+async def aconsume_ticket(ticket_uuid):
+    # GETDEL makes the ticket single use even when two workers race for it
+    claims = await get_async_redis().getdel(ticket_key(ticket_uuid))
+    if claims:
+        return json.loads(claims)
+    return None
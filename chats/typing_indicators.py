@@ -0,0 +1,76 @@
+import asyncio
+
+import redis
+from django.conf import settings
+
+from .events import apublish
+from .redis_client import get_async_redis
+
+
+def typing_key(conversation_name, sender):
+    return f"typing:{conversation_name}:{sender}"
+
+# Publishes typing_echo only when a sender starts or stops typing in a conversation,
+# repeated typing frames just extend the TYPING_TIMEOUT after which it stops by itself
+class TypingIndicatorMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.typing_timers = {}
+
+    async def set_typing(self, conversation_name, typing):
+        if typing:
+            await self.start_typing(conversation_name)
+        else:
+            await self.stop_typing(conversation_name)
+
+    async def start_typing(self, conversation_name):
+        sender = self.scope["user"].email
+        key = typing_key(conversation_name, sender)
+        client = get_async_redis()
+        # The key outlives the local timer and only expires by itself if this worker dies
+        expiry = settings.TYPING_TIMEOUT * 2
+        try:
+            started = await client.set(key, 1, nx=True, ex=expiry)
+            if not started:
+                await client.expire(key, expiry)
+        except redis.RedisError as e:
+            print(e)
+            started = True
+
+        timer = self.typing_timers.pop(conversation_name, None)
+        if timer:
+            timer.cancel()
+        self.typing_timers[conversation_name] = asyncio.create_task(self.expire_typing(conversation_name))
+
+        if started:
+            await self.publish_typing(conversation_name, sender, True)
+
+    async def stop_typing(self, conversation_name):
+        timer = self.typing_timers.pop(conversation_name, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+        sender = self.scope["user"].email
+        try:
+            stopped = await get_async_redis().delete(typing_key(conversation_name, sender))
+        except redis.RedisError as e:
+            print(e)
+            stopped = True
+        if stopped:
+            await self.publish_typing(conversation_name, sender, False)
+
+    async def expire_typing(self, conversation_name):
+        await asyncio.sleep(settings.TYPING_TIMEOUT)
+        await self.stop_typing(conversation_name)
+
+    async def stop_all_typing(self):
+        for conversation_name in list(self.typing_timers):
+            await self.stop_typing(conversation_name)
+
+    async def publish_typing(self, conversation_name, sender, typing):
+        await apublish(conversation_name, {
+            "type": "typing_echo",
+            "sender": sender,
+            "typing": typing,
+        })
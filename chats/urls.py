@@ -13,14 +13,20 @@ urlpatterns = [
     path('user/', views.UserView.as_view(), name='user'),
     path('profile/', views.ProfileView.as_view(), name='profile'),
     path('register-chat/', views.RegisterChatView.as_view(), name='register-chat'),
+    path('rate-limits/', views.RateLimitStatsView.as_view(), name='rate-limits'),
     path('conversations/', views.ConversationsView.as_view(), name='conversations'),
     path('archived-conversations/', views.ArchivedConversationsView.as_view(), name='archived-conversations'),
     path('conversations/<int:pk>/', views.ConversationDetailView.as_view(), name='conversation'),
+    path('conversations/<int:pk>/deletion/', views.ConversationDeletionView.as_view(), name='conversation-deletion'),
     path('assign-conversation/', views.assign_conversation, name='assign-conversation'),
     path('unassign-conversation/', views.unassign_conversation, name='unassign-conversation'),
     path('my-conversation/', views.MyConversationView.as_view(), name='my-conversation'),
     path('messages/', views.MessagesView.as_view({'get': 'list'}), name='messages'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('exports/', views.ExportView.as_view(), name='exports'),
     path('mark-as-read/', views.mark_message_as_read, name='mark-as-read'),
+    path('read-up-to/', views.ReadCursorView.as_view(), name='read-up-to'),
+    path('presence/', views.PresenceView.as_view(), name='presence'),
     path('payments/', views.PaymentsView.as_view(), name='payments'),
     path('payments/<int:pk>/', views.PaymentDetailView.as_view(), name='payment'),
     path('documents/', views.DocumentsView.as_view(), name='documents'),
@@ -2,18 +2,13 @@ import stripe
 import json
 import datetime
 
-from asgiref.sync import async_to_sync
-
-from channels.layers import get_channel_layer
-
-from uuid import uuid4
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 
 
 from django.conf import settings
+from django.db import transaction
 from django.shortcuts import render
-from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
@@ -24,15 +19,26 @@ from rest_framework.mixins import ListModelMixin
 from rest_framework.decorators import api_view
 from rest_framework import status, generics
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.utils.urls import replace_query_param
 
-from .models import Conversation, Message, Document, Payment, PaymentIntent, Profile, Integration
+from .models import Conversation, Message, Document, Payment, PaymentIntent, Profile
 from .serializers import RegisterSerializer, UserSerializer, ProfileSerializer, ConversationSerializer, MessageSerializer, DocumentSerializer, PaymentSerializer
 from .permissions import IsAdmin, IsAdminOrReadAuthenticated
-from .paginaters import MessagePagination
-from .my_gpt import get_my_ai_response
-from .whatsapp import send_whatsapp
-from .telegram import send_telegram
-from .mail import send_payment_success_mail, send_payment_notification_admins, send_document_upload_notification, send_conversation_assignment_notification, send_conversation_unassignment_notification, send_conversation_archive_change_notification, send_conversation_autopilot_deactivated
+from .paginaters import MessagePagination, ConversationPagination, AttachmentPagination
+from .filters import filter_created_at, filter_flags, get_fields_param, get_datetime_param
+from .search import search_messages
+from .exports import EXPORT_FORMATS
+from .inbound import validate_whatsapp_delivery, whatsapp_messages, telegram_messages, ingest_messages, process_whatsapp_delivery
+from .ledger import claim_events, release_events, record_events
+from .deletion import delete_conversation, get_deletion_progress, mark_for_deletion, set_progress
+from .payloads import get_message_payloads, get_message_payload
+from .events import publish, publish_messages, read_receipt_event
+from .jobs import enqueue
+from .counters import record_read_messages, read_up_to
+from .presence import get_online_user_ids
+from .throttling import get_dropped_counts
+from .tickets import issue_ticket
+from .mail import send_payment_success_mail, send_payment_notification_admins, send_document_upload_notification, send_conversation_assignment_notification, send_conversation_unassignment_notification, send_conversation_archive_change_notification
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 endpoint_secret = settings.STRIPE_ENDPOINT_SECRET
@@ -66,21 +72,66 @@ class RegisterChatView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        ticket_uuid = str(uuid4())
-        cache.set(ticket_uuid, request.user, timeout=60)
+        ticket_uuid = issue_ticket(request.user)
         return Response({'ticket_uuid': ticket_uuid})
 
+class ExportView(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('file_format', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': 'Invalid format'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            conversation = request.query_params.get('conversation')
+            created_after = get_datetime_param(request.query_params, 'created_after')
+            created_before = get_datetime_param(request.query_params, 'created_before')
+            conversation = int(conversation) if conversation else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not (conversation or created_after or created_before):
+            return Response({'error': 'Missing conversation or date range'}, status=status.HTTP_400_BAD_REQUEST)
+        # Downloads are plain browser navigations without our auth header, the
+        # single use ticket in the url stands in for it
+        ticket_uuid = issue_ticket(request.user, export={
+            'format': export_format,
+            'conversation': conversation,
+            'created_after': created_after.isoformat() if created_after else None,
+            'created_before': created_before.isoformat() if created_before else None,
+        })
+        return Response({'url': request.build_absolute_uri(f'/export/{ticket_uuid}/')}, status=status.HTTP_200_OK)
+
+class RateLimitStatsView(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return Response({'dropped': get_dropped_counts()}, status=status.HTTP_200_OK)
+
+def conversation_list_queryset():
+    return Conversation.objects.filter(pending_deletion=False).select_related('user__profile', 'integration')
+
+def serialize_conversations(conversations):
+    conversations = list(conversations)
+    last_messages = get_message_payloads([c.last_message_id for c in conversations if c.last_message_id])
+    context = {'last_messages': {payload['id']: payload for payload in last_messages}}
+    return ConversationSerializer(conversations, many=True, context=context).data
+
 class ConversationsView(ListAPIView):
     permission_classes = [IsAdmin]
     serializer_class = ConversationSerializer
-    queryset = Conversation.objects.filter(archived=False)
+    pagination_class = ConversationPagination
+    queryset = conversation_list_queryset().filter(archived=False)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(serialize_conversations(page))
 
 class ArchivedConversationsView(APIView):
     permission_classes = [IsAdmin]
     
     def get(self, request):
-        conversations = Conversation.objects.filter(archived=True)
-        data = ConversationSerializer(conversations, many=True).data
+        conversations = conversation_list_queryset().filter(archived=True).order_by('-updated_at', '-id')
+        data = serialize_conversations(conversations)
         return Response(data, status=status.HTTP_200_OK)
     
     def post(self, request):
@@ -91,7 +142,7 @@ class ArchivedConversationsView(APIView):
             except Conversation.DoesNotExist:
                 return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
             conversation.archived = conversation.archived == False
-            conversation.save()
+            conversation.save(update_fields=['archived', 'updated_at'])
             send_conversation_archive_change_notification(conversation)
             return Response({'success': True}, status=status.HTTP_200_OK)
         return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
@@ -122,8 +173,22 @@ class ConversationDetailView(APIView):
             conversation = Conversation.objects.get(id=pk)
         except Conversation.DoesNotExist:
             return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
-        conversation.delete()
-        return Response({'success': True}, status=status.HTTP_200_OK)
+        progress = get_deletion_progress(conversation.id)
+        # Deleting again re-enqueues a run that failed or was lost with its worker
+        if mark_for_deletion(conversation.id) or not progress or progress['state'] == 'failed':
+            set_progress(conversation.id, state='pending')
+            enqueue(delete_conversation, conversation.id)
+        return Response({'success': True, 'pending_deletion': True}, status=status.HTTP_202_ACCEPTED)
+
+
+class ConversationDeletionView(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request, pk, *args, **kwargs):
+        progress = get_deletion_progress(pk)
+        if progress is None:
+            return Response({'error': 'No deletion in progress'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress, status=status.HTTP_200_OK)
 
 
 class MyConversationView(APIView):
@@ -155,6 +220,62 @@ class MessagesView(ListModelMixin, GenericViewSet):
                 return Message.objects.filter(conversation=conversation).order_by('-created_at')
         return Message.objects.none()
 
+    def list(self, request, *args, **kwargs):
+        message_ids = self.get_queryset().values_list('id', flat=True)
+        page = self.paginate_queryset(message_ids)
+        return self.get_paginated_response(get_message_payloads(page))
+
+
+class SearchView(APIView):
+    permission_classes = [IsAdmin]
+    page_size = 20
+    max_page_size = 50
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Missing query'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', self.page_size)), 1), self.max_page_size)
+            conversation = request.query_params.get('conversation')
+            filters = {
+                'conversation': int(conversation) if conversation else None,
+                'channel': request.query_params.get('channel'),
+                'created_after': get_datetime_param(request.query_params, 'created_after'),
+                'created_before': get_datetime_param(request.query_params, 'created_before'),
+            }
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One extra hit tells whether there is a next page without counting matches
+        hits = search_messages(query, page_size + 1, (page - 1) * page_size, **filters)
+        url = request.build_absolute_uri()
+        payloads = {payload['id']: payload for payload in get_message_payloads([hit['id'] for hit in hits[:page_size]])}
+        results = [
+            {'message': payloads[hit['id']], 'rank': hit['rank'], 'highlight': hit['highlight']}
+            for hit in hits[:page_size] if hit['id'] in payloads
+        ]
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if len(hits) > page_size else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+
+class PresenceView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        conversation_id = request.query_params.get('conversation')
+        try:
+            conversation = Conversation.objects.get(id=conversation_id)
+        except (Conversation.DoesNotExist, ValueError):
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_400_BAD_REQUEST)
+        if conversation.user != request.user and not request.user.profile.admin:
+            return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response({'online': sorted(get_online_user_ids(conversation.name))}, status=status.HTTP_200_OK)
+
 
 class DocumentsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -162,21 +283,26 @@ class DocumentsView(APIView):
 
     def get(self, request):
         conversation_id = request.query_params.get(self.lookup_url_kwargs[0], None)
+        documents = Document.objects.all()
         if conversation_id:
             try:
                 conversation = Conversation.objects.get(id=conversation_id)
-            except Conversation.DoesNotExist:
+            except (Conversation.DoesNotExist, ValueError):
                 return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
             user = request.user
-            if conversation.user == user or user.profile.admin:
-                documents = Document.objects.filter(conversation=conversation)
-                return Response(DocumentSerializer(documents, many=True).data, status=status.HTTP_200_OK)
-        else:
-            if request.user.profile.admin:
-                documents = Document.objects.all()
-                return Response(DocumentSerializer(documents, many=True).data, status=status.HTTP_200_OK)
-            else:
+            if conversation.user != user and not user.profile.admin:
                 return Response({'success': False}, status=status.HTTP_401_UNAUTHORIZED)
+            documents = documents.filter(conversation=conversation)
+        elif not request.user.profile.admin:
+            return Response({'success': False}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            documents = filter_flags(filter_created_at(documents, request.query_params), request.query_params, ['staging'])
+        except ValueError as e:
+            return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = AttachmentPagination()
+        page = paginator.paginate_queryset(documents, request, view=self)
+        data = DocumentSerializer(page, many=True, fields=get_fields_param(request.query_params)).data
+        return paginator.get_paginated_response(data)
                 
     def post(self, request):
         data = request.data
@@ -205,15 +331,7 @@ class DocumentsView(APIView):
             staging=staging,
             message=message
         )
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            conversation.name,
-            {
-                'type': 'chat_message_echo',
-                'sender': message.from_user.email,
-                'message': MessageSerializer(message).data
-            }
-        )
+        publish_messages(conversation.name, message.from_user.email, [get_message_payload(message.id)])
         send_document_upload_notification(document)
         return Response(DocumentSerializer(document).data, status=status.HTTP_201_CREATED)
 
@@ -223,21 +341,25 @@ class PaymentsView(APIView):
 
     def get(self, request):
         conversation_id = request.query_params.get(self.lookup_url_kwargs[0], None)
+        payments = Payment.objects.all()
         if conversation_id:
             try:
                 conversation = Conversation.objects.get(id=conversation_id)
-            except Conversation.DoesNotExist:
+            except (Conversation.DoesNotExist, ValueError):
                 return Response({'error': 'Conversation not found'}, status=status.HTTP_400_BAD_REQUEST)
             if conversation.user != request.user and not request.user.profile.admin:
                 return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
-            payments = Payment.objects.filter(conversation=conversation)
-            return Response(PaymentSerializer(payments, many=True).data)
-        else:
-            if request.user.profile.admin:
-                payments = Payment.objects.all()
-                return Response(PaymentSerializer(payments, many=True).data)
-            else:
-                return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
+            payments = payments.filter(conversation=conversation)
+        elif not request.user.profile.admin:
+            return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            payments = filter_flags(filter_created_at(payments, request.query_params), request.query_params, ['paid'])
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = AttachmentPagination()
+        page = paginator.paginate_queryset(payments, request, view=self)
+        data = PaymentSerializer(page, many=True, fields=get_fields_param(request.query_params)).data
+        return paginator.get_paginated_response(data)
 
     def post(self, request):
         data = request.data
@@ -301,7 +423,7 @@ def assign_conversation(request):
     if not request.user.profile.admin:
         return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
     conversation.assigned_to = request.user
-    conversation.save()
+    conversation.save(update_fields=['assigned_to', 'updated_at'])
     send_conversation_assignment_notification(conversation)
     return Response({'success': True}, status=status.HTTP_200_OK)
 
@@ -320,10 +442,42 @@ def unassign_conversation(request):
     if conversation.assigned_to != request.user:
         return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
     conversation.assigned_to = None
-    conversation.save()
+    conversation.save(update_fields=['assigned_to', 'updated_at'])
     send_conversation_unassignment_notification(conversation)
     return Response({'success': True}, status=status.HTTP_200_OK)
         
+class ReadCursorView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_conversation(self, request, conversation_id):
+        try:
+            conversation = Conversation.objects.get(id=conversation_id)
+        except (Conversation.DoesNotExist, ValueError):
+            return None
+        if conversation.user != request.user and not request.user.profile.admin:
+            return None
+        return conversation
+
+    def get(self, request, *args, **kwargs):
+        conversation = self.get_conversation(request, request.query_params.get('conversation'))
+        if not conversation:
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_400_BAD_REQUEST)
+        cursors = conversation.read_cursors.values('user', 'last_read_message_id', 'updated_at')
+        return Response(list(cursors), status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            conversation_id = request.data['conversation']
+            message_id = int(request.data['message'])
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'Missing data'}, status=status.HTTP_400_BAD_REQUEST)
+        conversation = self.get_conversation(request, conversation_id)
+        if not conversation:
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_400_BAD_REQUEST)
+        if read_up_to(request.user, conversation, message_id):
+            publish(conversation.name, read_receipt_event(request.user, message_id))
+        return Response({'success': True}, status=status.HTTP_200_OK)
+
 @api_view(['POST'])
 def mark_message_as_read(request):
     try:
@@ -336,8 +490,10 @@ def mark_message_as_read(request):
         return Response({'error': 'Message not found'}, status=status.HTTP_400_BAD_REQUEST)
     if message.conversation.user != request.user and not request.user.profile.admin:
         return Response({'error': 'Not authorized'}, status=status.HTTP_401_UNAUTHORIZED)
-    message.read = True
-    message.save()
+    if not message.read:
+        message.read = True
+        message.save()
+        record_read_messages([message])
     return Response({'success': True}, status=status.HTTP_200_OK)
 
 
@@ -393,22 +549,33 @@ def webhook(request):
         except stripe.error.SignatureVerificationError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        if not claim_events('stripe', [event['id']]):
+            return Response({'success': True}, status=status.HTTP_200_OK)
+
         if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
             try:
-                payment_intent_object = PaymentIntent.objects.get(payment_intent_id=payment_intent['id'])
-                payment = payment_intent_object.payment
-                payment.paid = True
-                payment.date_paid = datetime.datetime.utcnow()
-                payment.save()
+                payment_intent = event['data']['object']
+                with transaction.atomic():
+                    payment_intent_object = PaymentIntent.objects.select_related('payment').get(payment_intent_id=payment_intent['id'])
+                    if not record_events('stripe', [event['id']]):
+                        return Response({'success': True}, status=status.HTTP_200_OK)
+                    payment = payment_intent_object.payment
+                    payment.paid = True
+                    payment.date_paid = datetime.datetime.utcnow()
+                    payment.save()
                 send_payment_success_mail(payment)
                 send_payment_notification_admins(payment)
             except PaymentIntent.DoesNotExist:
+                release_events('stripe', [event['id']])
                 return Response({'error': 'Payment intent not found'}, status=status.HTTP_400_BAD_REQUEST)
+            except Exception:
+                release_events('stripe', [event['id']])
+                raise
         elif event['type'] == 'payment_intent.created':
             payment_method = event['data']['object']
         else:
             #Unexpected event type
+            release_events('stripe', [event['id']])
             return Response({'error': 'Unexpected event type'}, status=status.HTTP_400_BAD_REQUEST)
 
     return Response({'success': True}, status=status.HTTP_200_OK)
@@ -425,114 +592,21 @@ def whatsapp_webhook(request):
             data = json.loads(request.body)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        
-        if 'entry' not in data:
-            return Response({'error': 'Entry not found'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        entries = data['entry']
-        for entry in entries:
-            if 'changes' not in entry:
-                return Response({'error': 'Changes not found'}, status=status.HTTP_400_BAD_REQUEST)
-            changes = entry['changes']
-            for change in changes:
-
-                if 'value' not in change:
-                    return Response({'error': 'Value not found'}, status=status.HTTP_400_BAD_REQUEST)
-                
-                value = change['value']
 
-                if 'messages' not in value:
-                    return Response({'error': 'Messages not found'}, status=status.HTTP_400_BAD_REQUEST)
-                
-                messages = value['messages']
-
-                for message in messages:
-                    phone_number = message['from']
-
-                    try:
-                        sender_user = User.objects.get(phone=phone_number)
-                    except User.DoesNotExist:
-                        sender_user = User.objects.create(phone=phone_number)
-
-                    whatsapp_integration, created = Integration.objects.get_or_create(channel='whatsapp')
-
-                    try:
-                        conversation = Conversation.objects.get(name=phone_number,
-                                                                integration__channel='whatsapp',
-                                                                user=sender_user)
-                    except Conversation.DoesNotExist:
-                        conversation = Conversation.objects.create(name=phone_number,
-                                                                    integration=whatsapp_integration,
-                                                                    user=sender_user)
-                                                                                
-                    if conversation.integration.channel != 'whatsapp':
-                        return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    new_message = Message.objects.create(
-                                        conversation=conversation,
-                                        from_user=conversation.user,
-                                        message=message['text']['body'],
-                                        read=False
-                                    )
-                    
-                    try:
-                        channel_layer = get_channel_layer()
-                        async_to_sync(channel_layer.group_send)(
-                            conversation.name,
-                            {
-                                'type': 'chat_message_echo',
-                                'sender': new_message.from_user.phone,
-                                'message': MessageSerializer(new_message).data
-                            }
-                        )
-                    except Exception as e:
-                        print(e)
-
-                    if conversation.autopilot:
-                        past_messages = Message.objects.filter(conversation=conversation).order_by('-created_at')[:settings.AI_CONTEXT_SIZE]
-                        past_messages = past_messages[::-1]
-                        past_messages = MessageSerializer(past_messages, many=True).data
-
-                        try:
-                            try:
-                                ai_response = get_my_ai_response(past_messages)
-                            except Exception as e:
-                                print(e)
-
-                            send_whatsapp(phone_number, ai_response)
-                            
-                            ai_user = Profile.objects.get(AI=True).user
-                            ai_message = Message.objects.create(
-                                                conversation=conversation,
-                                                from_user=ai_user,
-                                                message=ai_response,
-                                                read=False
-                                            )
-                            try:
-                                channel_layer = get_channel_layer()
-                                async_to_sync(channel_layer.group_send)(
-                                    conversation.name,
-                                    {
-                                        'type': 'chat_message_echo',
-                                        'sender': ai_user,
-                                        'message': MessageSerializer(ai_message).data
-                                    }
-                                )
-                            except Exception as e:
-                                print(e)
-                            
-                        except Exception as e:
-                            conversation.autopilot = False
-                            try:
-                                send_whatsapp(phone_number, "Ay, me desactivaron el autopilot")
-                            except Exception as e:
-                                print(e)
-
-                            conversation.save()
-                            send_conversation_autopilot_deactivated(conversation)
-                            
-                    return Response({'success': True}, status=status.HTTP_200_OK)
-                
+        error = validate_whatsapp_delivery(data)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Meta retries slow deliveries, so acknowledge first and let a worker do the rest
+        event_ids = claim_events('whatsapp', [item['event_id'] for item in whatsapp_messages(data)])
+        if event_ids:
+            try:
+                enqueue(process_whatsapp_delivery, data)
+            except Exception:
+                release_events('whatsapp', event_ids)
+                raise
+        return Response({'success': True}, status=status.HTTP_200_OK)
+
 @api_view(['POST', 'GET'])
 def telegram_webhook(request):
     if request.method == 'POST':
@@ -540,82 +614,14 @@ def telegram_webhook(request):
             data = json.loads(request.body)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        
-
-        phone_number_id = data['message']['chat']['id']
-
-        try:
-            sender_user = User.objects.get(phone=phone_number_id)
-        except User.DoesNotExist:
-            sender_user = User.objects.create(phone=phone_number_id)
-
-        telegram_integration, created = Integration.objects.get_or_create(channel='telegram')
-
-        try:
-            conversation = Conversation.objects.get(name=phone_number_id,
-                                                    integration__channel='whatsapp',
-                                                    user=sender_user)
-        except Conversation.DoesNotExist:
-            conversation = Conversation.objects.create(name=phone_number_id,
-                                                        integration=telegram_integration,
-                                                        user=sender_user)
-                                                                    
-        if conversation.integration.channel != 'telegram':
-            return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
-        
-        new_message = Message.objects.create(
-                            conversation=conversation,
-                            from_user=conversation.user,
-                            message=data['message']['text'],
-                            read=False
-                        )
-        
-        try:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                conversation.name,
-                {
-                    'type': 'chat_message_echo',
-                    'sender': new_message.from_user.phone,
-                    'message': MessageSerializer(new_message).data
-                }
-            )
-        except Exception as e:
-            print(e)
-
-        if conversation.autopilot:
-            past_messages = Message.objects.filter(conversation=conversation).order_by('-created_at')[:settings.AI_CONTEXT_SIZE]
-            past_messages = past_messages[::-1]
-            past_messages = MessageSerializer(past_messages, many=True).data
 
+        items = telegram_messages([data])
+        event_ids = claim_events('telegram', [item['event_id'] for item in items])
+        if event_ids:
             try:
-                ai_response = get_my_ai_response(past_messages)
-                send_telegram(phone_number_id, ai_response)
-                
-                ai_user = Profile.objects.get(AI=True).user
-                ai_message = Message.objects.create(
-                                    conversation=conversation,
-                                    from_user=ai_user,
-                                    message=ai_response,
-                                    read=False
-                                )
-                
-                try:
-                    channel_layer = get_channel_layer()
-                    async_to_sync(channel_layer.group_send)(
-                        conversation.name,
-                        {
-                            'type': 'chat_message_echo',
-                            'sender': ai_user,
-                            'message': MessageSerializer(ai_message).data
-                        }
-                    )
-                except Exception as e:
-                    print(e)
-                
-            except Exception as e:
-                conversation.autopilot = False
-                conversation.save()
-                send_conversation_autopilot_deactivated(conversation)
-                
+                ingest_messages('telegram', [item for item in items if item['event_id'] in event_ids])
+            except Exception:
+                release_events('telegram', event_ids)
+                raise
+
         return Response({'success': True}, status=status.HTTP_200_OK)
\ No newline at end of file
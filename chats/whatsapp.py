@@ -1,11 +1,13 @@
-import requests
 from django.conf import settings
 
+from . import http_client
+
 WHATSAPP_NUMBER_IDENTIFIER = settings.WHATSAPP_NUMBER_IDENTIFIER
 ACCESS_TOKEN = settings.WHATSAPP_ACCESS_TOKEN
+WHATSAPP_API_URL = settings.WHATSAPP_API_URL
 
 def send_whatsapp(phone_number, message):
-  url = f"https://graph.facebook.com/v17.0/{WHATSAPP_NUMBER_IDENTIFIER}/messages"
+  url = f"{WHATSAPP_API_URL}/{WHATSAPP_NUMBER_IDENTIFIER}/messages"
 
   headers = {
     "Content-Type": "application/json",
@@ -21,7 +23,4 @@ def send_whatsapp(phone_number, message):
              "preview_url": "true"},
   }
   
-  try:
-    r = requests.post(url, json=json, headers=headers)
-  except requests.exceptions.HTTPError as err:
-    print(err)
\ No newline at end of file
+  return http_client.post(url, json=json, headers=headers, status_retries=False)